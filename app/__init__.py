@@ -3,24 +3,38 @@
 import os
 import logging
 import time
+import importlib
+import hashlib
+import decimal
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from flask import Flask, render_template
+from datetime import datetime, timezone
+from flask import Flask, render_template, g, has_request_context, current_app
+from flask.json.provider import JSONProvider
 from flask_login import LoginManager
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_mail import Mail
-from .models import db
+from sqlalchemy import event, select, update, delete, func, text
+from .models import db, UserStyle
+from .config import Settings
 from flask_wtf import CSRFProtect
 
 logger = logging.getLogger(__name__)
 csrf = CSRFProtect()
 
-# Rate limiter setup (configurable storage)
+# Rate limiter setup (configurable storage and strategy)
+# - fixed-window: O(1) memory per key, but allows up to 2x bursts across a window edge
+# - sliding-window-counter (limits>=4.1): O(1) memory per key, smooths the window edge
+# - moving-window: exact, but stores every hit (O(limit) per key); only use for small limits
+# memory:// is per-process; point LIMITER_STORAGE_URI at Redis when running several workers.
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["100 per hour"],
+    strategy=os.getenv("LIMITER_STRATEGY", "fixed-window"),
     storage_uri=os.getenv("LIMITER_STORAGE_URI", "memory://")
 )
 
@@ -28,6 +42,156 @@ migrate = Migrate()
 mail = Mail()
 
 DB_NAME = "database.db"
+DEFAULT_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-64000",
+)
+
+
+def get_redis():
+    """Shared Redis client when REDIS_URL is configured, otherwise None."""
+    return current_app.extensions.get("redis")
+
+
+def utcnow():
+    """Naive UTC timestamp, computed once per request so every use in a handler agrees."""
+    if not has_request_context():
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    if "_now" not in g:
+        g._now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return g._now
+
+
+def _orjson_default(obj):
+    # Types Flask's default provider handled that orjson doesn't
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ORJSONProvider(JSONProvider):
+    """orjson-backed JSON provider; datetimes serialize natively as ISO 8601."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def _schema_fingerprint():
+    """Hash of table/column/index names, so the marker goes stale when models change."""
+    parts = []
+    for table in sorted(db.metadata.tables.values(), key=lambda t: t.name):
+        parts.append(table.name)
+        parts.extend(sorted(c.name for c in table.columns))
+        parts.extend(sorted(i.name or "" for i in table.indexes))
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def _merge_duplicate_user_styles():
+    """Fold duplicate (user_id, style_name) rows into one with the summed count.
+
+    The old select-then-insert in increment_user_style could race and leave duplicates,
+    which would stop the unique index behind its upsert from being created.
+    """
+    dupes = db.session.execute(
+        select(
+            UserStyle.user_id,
+            UserStyle.style_name,
+            func.min(UserStyle.id),
+            func.sum(func.coalesce(UserStyle.count, 1)),
+        )
+        .group_by(UserStyle.user_id, UserStyle.style_name)
+        .having(func.count() > 1)
+    ).all()
+    for user_id, style_name, keep_id, total in dupes:
+        db.session.execute(update(UserStyle).where(UserStyle.id == keep_id).values(count=total))
+        db.session.execute(
+            delete(UserStyle).where(
+                UserStyle.user_id == user_id,
+                UserStyle.style_name == style_name,
+                UserStyle.id != keep_id,
+            )
+        )
+    if dupes:
+        db.session.commit()
+        logger.warning(f"Merged duplicate user_style rows for {len(dupes)} (user, style) pairs")
+
+
+# Indexes dropped from the models; removed from existing databases on the next schema check
+RETIRED_INDEXES = (
+    "ix_chatmessage_imageurl_ts",  # full image_url copies; replaced by the URL-tail index
+)
+
+
+def _ensure_schema(app, db_path, mode):
+    """Run db.create_all() only when the schema marker next to the database is missing or stale.
+
+    RUN_CREATE_ALL=1 forces it, RUN_CREATE_ALL=0 disables it (e.g. when using `flask db upgrade`).
+    """
+    if mode == "0":
+        return
+    marker = f"{db_path}.schema"
+    fingerprint = _schema_fingerprint()
+    if mode != "1" and os.path.exists(db_path):
+        try:
+            with open(marker) as f:
+                if f.read().strip() == fingerprint:
+                    return
+        except OSError:
+            pass
+    failed = []
+    with app.app_context():
+        db.create_all()
+        _merge_duplicate_user_styles()
+        with db.engine.begin() as conn:
+            for name in RETIRED_INDEXES:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        # create_all skips tables that already exist, so add any indexes declared since
+        for table in db.metadata.tables.values():
+            for index in table.indexes:
+                try:
+                    index.create(bind=db.engine, checkfirst=True)
+                except Exception as e:
+                    if index.unique:
+                        # Upserts (ON CONFLICT) depend on these; running without one breaks writes
+                        raise RuntimeError(f"Could not create unique index {index.name}: {e}") from e
+                    failed.append(index.name)
+                    logger.warning(f"Could not create index {index.name}: {e}")
+    if failed:
+        # No marker for a partly applied schema, so the next boot retries it
+        logger.error(f"Schema incomplete ({', '.join(failed)}); not writing {marker}")
+        return
+    try:
+        with open(marker, "w") as f:
+            f.write(fingerprint)
+    except OSError as e:
+        logger.warning(f"Could not write schema marker {marker}: {e}")
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # Runs once per pooled connection, not per request
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+# (module, blueprint attribute, url prefix)
+BLUEPRINTS = (
+    (".views", "views", "/"),
+    (".auth", "auth", "/auth"),
+    (".chat", "chat", "/chat"),
+    (".routes", "api", "/api"),
+    (".admin", "admin", "/admin"),
+)
 
 def create_app():
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -43,40 +207,40 @@ def create_app():
     os.makedirs(STORAGE_FOLDER, exist_ok=True)
     default_db_path = os.path.join(STORAGE_FOLDER, DB_NAME)
 
-    # Allow environment variable override
-    DB_PATH = os.getenv('DATABASE_PATH', default_db_path)
+    # Parse environment once; DATABASE_PATH overrides the default location
+    settings = Settings.from_env(default_db_path)
+    DB_PATH = settings.database_path
 
     app = Flask(
         __name__,
         template_folder=TEMPLATE_FOLDER,
         static_folder=STATIC_FOLDER
     )
+    app.json = ORJSONProvider(app)
 
-    # CORS origins configurable
-    origins = os.getenv(
-        "CORS_ORIGINS",
-        "http://localhost:5000,http://127.0.0.1:5000"
-    ).split(",")
-    CORS(app, supports_credentials=True, resources={r"/*": {"origins": origins}})
+    # CORS origins configurable; let browsers cache preflight responses (default 24h)
+    origins = list(settings.cors_origins)
+    CORS(app, supports_credentials=True, max_age=settings.cors_max_age,
+         resources={r"/*": {"origins": origins, "max_age": settings.cors_max_age}})
 
     # Secret key (must be set in env)
-    secret = os.getenv("SECRET_KEY")
-    if not secret:
+    if not settings.secret_key:
         raise RuntimeError("SECRET_KEY must be set")
-    app.config['SECRET_KEY'] = secret
 
-    # Configure app settings
+    # Configure app settings (secret key, mail, password hashing, backend service)
+    app.config.update(settings.flask_config())
     app.config.update(
         SQLALCHEMY_DATABASE_URI=f'sqlite:///{DB_PATH}',
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
-
-        # Flask-Mail configuration
-        MAIL_SERVER=os.getenv('MAIL_SERVER'),
-        MAIL_PORT=int(os.getenv('MAIL_PORT', 587)),
-        MAIL_USE_TLS=os.getenv('MAIL_USE_TLS', 'True').lower() == 'true',
-        MAIL_USERNAME=os.getenv('MAIL_USERNAME'),
-        MAIL_PASSWORD=os.getenv('MAIL_PASSWORD'),
-        MAIL_DEFAULT_SENDER=os.getenv('MAIL_DEFAULT_SENDER'),
+        # Keep SQLite connections pooled and shareable across worker threads. Size the pool to
+        # the worker's thread count. No pre-ping: a local file connection can't go stale, and
+        # the 30s busy timeout already retries lock contention inside SQLite.
+        SQLALCHEMY_ENGINE_OPTIONS={
+            "pool_size": settings.db_pool_size,
+            "max_overflow": settings.db_max_overflow,
+            "pool_pre_ping": False,
+            "connect_args": {"check_same_thread": False, "timeout": 30},
+        },
 
         # Secure cookies (production)
         SESSION_COOKIE_SECURE=True,
@@ -84,19 +248,40 @@ def create_app():
         SESSION_COOKIE_HTTPONLY=True,
         REMEMBER_COOKIE_HTTPONLY=True,
         SESSION_COOKIE_SAMESITE='Lax',
-
-        # Backend Service Configuration
-        COLAB_ENDPOINT=os.getenv('COLAB_ENDPOINT'),
-        BACKEND_TIMEOUT=int(os.getenv('BACKEND_TIMEOUT', 60)),
-        USE_LOCAL_BERT=os.getenv('USE_LOCAL_BERT', 'False').lower() == 'true',
-        OFFLINE_MODE=os.getenv('OFFLINE_MODE', 'False').lower() == 'true'
     )
 
     csrf.init_app(app)
     db.init_app(app)
+    with app.app_context():
+        event.listen(db.engine, "connect", _set_sqlite_pragmas)
     migrate.init_app(app, db)
     limiter.init_app(app)
     mail.init_app(app)
+    # SMTP sends run here so requests don't wait on the mail server
+    app.mail_executor = ThreadPoolExecutor(
+        max_workers=settings.mail_workers, thread_name_prefix='mail'
+    )
+
+    # Optional Redis for caches shared across workers; callers fall back to in-process state
+    if settings.redis_url:
+        try:
+            import redis
+            app.extensions["redis"] = redis.Redis.from_url(settings.redis_url)
+        except ImportError:
+            logger.warning("REDIS_URL is set but the redis package is not installed")
+
+    # Compress JSON/HTML responses (brotli preferred); level 4 keeps CPU well below the wire time saved
+    app.config.update(
+        COMPRESS_ALGORITHM=['br', 'gzip'],
+        COMPRESS_LEVEL=4,
+        COMPRESS_BR_LEVEL=4,
+        COMPRESS_MIN_SIZE=500,
+    )
+    try:
+        from flask_compress import Compress
+        Compress(app)
+    except ImportError:
+        logger.warning("flask-compress is not installed; responses are sent uncompressed")
 
     # Setup Flask-Login
     login_manager = LoginManager()
@@ -107,24 +292,23 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
-
-    # Register blueprints
-    from .views import views
-    from .auth import auth
-    from .chat import chat
-    from .routes import api
-    from .admin import admin
-
-    app.register_blueprint(views, url_prefix='/')
-    app.register_blueprint(auth, url_prefix='/auth')
-    app.register_blueprint(chat, url_prefix='/chat')
-    app.register_blueprint(api, url_prefix='/api')
-    app.register_blueprint(admin, url_prefix='/admin')
-
-    # Auto-create database tables if they don't exist
-    with app.app_context():
-        db.create_all()
+        # Flask-Login already caches the result on g for the rest of the request;
+        # Session.get checks the identity map before emitting a SELECT.
+        return db.session.get(User, int(user_id))
+
+    # Register blueprints (heavy deps such as BERT are imported on first use)
+    for module_name, attr, url_prefix in BLUEPRINTS:
+        module = importlib.import_module(module_name, __name__)
+        app.register_blueprint(getattr(module, attr), url_prefix=url_prefix)
+
+    # Fold Redis-buffered design counters into the user rows on a timer, so pages that list
+    # many users (the admin views) stay close to current without flushing per request
+    if "redis" in app.extensions and settings.stats_flush_interval > 0:
+        from .routes import start_stats_flusher
+        start_stats_flusher(app, settings.stats_flush_interval)
+
+    # Auto-create database tables if they don't exist (skipped when the schema marker is current)
+    _ensure_schema(app, DB_PATH, settings.run_create_all)
 
     # Error Handlers
     @app.errorhandler(404)
@@ -137,9 +321,12 @@ def create_app():
         return render_template('errors/500.html'), 500
 
     @app.template_filter('datetime')
-    def format_datetime(value, format='%Y-%m-%d %H:%M:%S'):
+    def format_datetime(value, format=DEFAULT_DATETIME_FORMAT):
         if value is None:
             return ""
+        # isoformat skips strftime's format parsing; identical output for naive datetimes
+        if format == DEFAULT_DATETIME_FORMAT and value.tzinfo is None:
+            return value.isoformat(sep=" ", timespec="seconds")
         return value.strftime(format)
 
     # Attach backend service
@@ -152,20 +339,19 @@ def create_app():
     return app
 
 
-# Optional timing decorator (unchanged)
+# Optional timing decorator
 def monitor_response_time(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         try:
             result = func(*args, **kwargs)
-            end_time = time.time()
-            duration = end_time - start_time
-            logger.info(f"Operation '{func.__name__}' completed in {duration:.2f} seconds")
-            return result
         except Exception as e:
-            end_time = time.time()
-            duration = end_time - start_time
-            logger.error(f"Operation '{func.__name__}' failed after {duration:.2f} seconds: {str(e)}")
+            logger.error("Operation '%s' failed after %.2f seconds: %s",
+                         func.__name__, (time.perf_counter_ns() - start_ns) / 1e9, e)
             raise
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Operation '%s' completed in %.2f seconds",
+                        func.__name__, (time.perf_counter_ns() - start_ns) / 1e9)
+        return result
     return wrapper
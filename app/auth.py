@@ -1,17 +1,18 @@
 # app/auth.py
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, abort, session
 from flask_login import login_user, logout_user, login_required, current_user
-from .models import User, db, FavoriteImage, ChatMessage, ImageRating, ChatSession
+from .models import User, db, FavoriteImage, ChatMessage, ImageRating
+from . import limiter, utcnow
+from .routes import flush_user_stats
+from flask_limiter.util import get_remote_address
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
-from sqlalchemy import or_
+from sqlalchemy import or_, exists
 from functools import wraps
 from flask_mail import Mail, Message
-from flask_wtf.csrf import CSRFError, validate_csrf, generate_csrf
-from sqlalchemy.orm import joinedload
-from collections import Counter
-import logging, re, os, random
-from datetime import datetime, timedelta
+from flask_wtf.csrf import CSRFError, generate_csrf
+import logging, re, os, secrets
+from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 auth = Blueprint("auth", __name__)
@@ -26,21 +27,58 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated
 
+CODE_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+def generate_code(length=6):
+    """Random verification/reset code from the OS CSPRNG."""
+    return "".join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+def email_or_ip():
+    """Rate-limit key: the submitted email when present, otherwise the client IP."""
+    data = request.get_json(silent=True) or {}
+    email = str(data.get("email") or "").strip().lower()
+    return email or get_remote_address()
+
+def _send_with_app_ctx(app, msg):
+    with app.app_context():
+        try:
+            mail.send(msg)
+        except Exception as e:
+            logger.error(f"Mail send failed ({msg.subject}): {e}")
+
+def send_email(msg):
+    """Queue msg on the app's mail executor and return immediately."""
+    app = current_app._get_current_object()
+    app.mail_executor.submit(_send_with_app_ctx, app, msg)
+
+def hash_password(pw):
+    """Hash with the configured method; check_password_hash reads the method from the hash itself."""
+    return generate_password_hash(pw, method=current_app.config.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1"))
+
 def get_serializer():
-    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"])
+    # Built once per app and reused; rebuilt only if SECRET_KEY changes
+    secret = current_app.config["SECRET_KEY"]
+    cached = current_app.extensions.get("auth_serializer")
+    if cached is None or cached[0] != secret:
+        cached = (secret, URLSafeTimedSerializer(secret))
+        current_app.extensions["auth_serializer"] = cached
+    return cached[1]
+
+EMAIL_RE = re.compile(r"^[\w\.-]+@[\w\.-]+\.\w+$")
+USERNAME_RE = re.compile(r"^[a-zA-Z0-9_]{3,20}$")
+PASSWORD_CLASSES = (re.compile(r"[a-z]"), re.compile(r"[A-Z]"), re.compile(r"\d"), re.compile(r"[^\w\s]"))
 
-def validate_email(email): return re.match(r"^[\w\.-]+@[\w\.-]+\.\w+$", email)
-def validate_username(username): return re.match(r"^[a-zA-Z0-9_]{3,20}$", username)
+def validate_email(email): return EMAIL_RE.match(email)
+def validate_username(username): return USERNAME_RE.match(username)
 
 def strong_password(pw:str)->bool:
     if len(pw) < 12: return False
-    classes = sum([
-        bool(re.search(r"[a-z]", pw)),
-        bool(re.search(r"[A-Z]", pw)),
-        bool(re.search(r"\d", pw)),
-        bool(re.search(r"[^\w\s]", pw))
-    ])
-    return classes >= 3
+    classes = 0
+    for pattern in PASSWORD_CLASSES:
+        if pattern.search(pw):
+            classes += 1
+            if classes >= 3: return True
+    return False
 
 # ---------------- CSRF token ----------------
 @auth.route("/csrf-token")
@@ -50,6 +88,7 @@ def get_csrf_token():
 
 # ---------------- Signup & Verification ----------------
 @auth.route("/signup", methods=["GET", "POST"])
+@limiter.limit("3/minute;20/day", methods=["POST"])
 def signup():
     if request.method == "GET":
         return render_template("signup.html")
@@ -61,17 +100,18 @@ def signup():
     if not validate_email(email): return jsonify({"success":False,"message":"Invalid email"}),400
     if not validate_username(username): return jsonify({"success":False,"message":"Invalid username"}),400
     if not strong_password(password): return jsonify({"success":False,"message":"Weak password"}),400
-    if User.query.filter(or_(User.email==email, User.username==username)).first():
+    # Two EXISTS probes, each served by its own UNIQUE index, in one round trip
+    if db.session.query(or_(exists().where(User.email==email), exists().where(User.username==username))).scalar():
         return jsonify({"success":False,"message":"Email or username already in use"}),400
 
     try:
-        code = "".join(random.choices("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ", k=6))
+        code = generate_code()
         new_user = User(email=email, username=username,
-                        password=generate_password_hash(password),
+                        password=hash_password(password),
                         is_verified=False, verification_code=code,
-                        verification_expires_at=datetime.utcnow()+timedelta(minutes=10))
+                        verification_expires_at=utcnow()+timedelta(minutes=10))
         db.session.add(new_user); db.session.commit()
-        mail.send(Message("Verification Code", recipients=[email],
+        send_email(Message("Verification Code", recipients=[email],
                           body=f"Hi {username}, your code is: {code} (expires in 10 min)"))
         return jsonify({"success":True,"message":"Check your email for the verification code."}),200
     except Exception as e:
@@ -79,33 +119,36 @@ def signup():
         return jsonify({"success":False,"message":"Internal error"}),500
 
 @auth.route("/verify-code", methods=["POST"])
+@limiter.limit("10/minute")
 def verify_code():
     data=request.get_json() or {}
     email, code = data.get("email","").strip(), data.get("code","").strip()
     user = User.query.filter_by(email=email).first()
     if not user: return jsonify({"success":False,"message":"User not found"}),404
     if user.is_verified: return jsonify({"success":False,"message":"Already verified"}),400
-    if user.verification_code!=code or user.verification_expires_at<datetime.utcnow():
+    if user.verification_code!=code or user.verification_expires_at<utcnow():
         return jsonify({"success":False,"message":"Invalid/expired code"}),400
     user.is_verified=True; user.verification_code=None; user.verification_expires_at=None
     db.session.commit()
     return jsonify({"success":True,"message":"Account verified"}),200
 
 @auth.route("/resend-code", methods=["POST"])
+@limiter.limit("3/minute;20/day")
 def resend_code():
-    validate_csrf(request.headers.get("X-CSRFToken"))
     data=request.get_json() or {}; email=data.get("email","").strip()
     user=User.query.filter_by(email=email).first()
     if not user: return jsonify({"success":False,"message":"User not found"}),404
     if user.is_verified: return jsonify({"success":False,"message":"Already verified"}),400
-    code="".join(random.choices("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ",k=6))
-    user.verification_code=code; user.verification_expires_at=datetime.utcnow()+timedelta(minutes=10)
+    code=generate_code()
+    user.verification_code=code; user.verification_expires_at=utcnow()+timedelta(minutes=10)
     db.session.commit()
-    mail.send(Message("New Verification Code",recipients=[email],body=f"Hi {user.username}, code: {code}"))
+    send_email(Message("New Verification Code",recipients=[email],body=f"Hi {user.username}, code: {code}"))
     return jsonify({"success":True,"message":"New code sent"}),200
 
 # ---------------- Login / Logout ----------------
 @auth.route("/login", methods=["GET","POST"])
+@limiter.limit("5/minute;50/hour", methods=["POST"], key_func=email_or_ip)
+@limiter.limit("20/minute;200/hour", methods=["POST"])  # per IP, so one client can't spray many emails
 def login():
     if request.method=="GET": return render_template("login.html")
     data=request.get_json() or {}
@@ -129,9 +172,9 @@ def logout():
 
 # ---------------- Admin-only Delete ----------------
 @auth.route("/api/admin/user/<int:user_id>", methods=["DELETE"])
-@login_required @admin_required
+@admin_required
 def delete_user(user_id):
-    u=User.query.get(user_id)
+    u=db.session.get(User, user_id)
     if not u: return jsonify({"message":"Not found"}),404
     db.session.delete(u); db.session.commit()
     return jsonify({"message":"Deleted"}),200
@@ -140,13 +183,20 @@ def delete_user(user_id):
 @auth.route("/profile")
 @login_required
 def profile():
+    # Fold any Redis-buffered design counters into the row before showing them
+    if flush_user_stats(current_user.id):
+        db.session.expire(current_user._get_current_object(), ("designs_created", "designs_shared"))
     favorites=FavoriteImage.query.filter_by(user_id=current_user.id).all()
-    recent_msgs=(ChatMessage.query.join(ChatSession)
-                 .options(joinedload(ChatMessage.session_obj))
-                 .filter(ChatSession.user_id==current_user.id, ChatMessage.image_url!=None)
+    recent_msgs=(ChatMessage.query
+                 .with_entities(ChatMessage.id, ChatMessage.session_id,
+                                ChatMessage.image_url, ChatMessage.timestamp)
+                 .filter(ChatMessage.user_id==current_user.id, ChatMessage.image_url!=None)
                  .order_by(ChatMessage.timestamp.desc()).limit(9).all())
-    detected=[m.detected_style for m in recent_msgs if m.detected_style]
-    most_detected=Counter(detected).most_common(1)[0][0] if detected else ""
+    most_detected=(db.session.query(ChatMessage.detected_style)
+                   .filter(ChatMessage.user_id==current_user.id,
+                           ChatMessage.image_url!=None, ChatMessage.detected_style!=None)
+                   .group_by(ChatMessage.detected_style)
+                   .order_by(db.func.count().desc()).limit(1).scalar()) or ""
     rating_summary=db.session.query(db.func.avg(ImageRating.prompt_relevance),
                                     db.func.avg(ImageRating.image_quality),
                                     db.func.avg(ImageRating.style_accuracy))\
@@ -162,7 +212,6 @@ def profile():
 @auth.route("/update_profile", methods=["POST"])
 @login_required
 def update_profile():
-    validate_csrf(request.headers.get("X-CSRFToken"))
     data=request.get_json() or {}
     username,email=data.get("username",""),data.get("email","")
     curr_pw,new_pw=data.get("current_password"),data.get("new_password")
@@ -175,38 +224,37 @@ def update_profile():
     current_user.username=username; current_user.email=email
     if new_pw:
         if not strong_password(new_pw): return jsonify({"success":False,"message":"Weak password"}),400
-        current_user.password=generate_password_hash(new_pw)
+        current_user.password=hash_password(new_pw)
     db.session.commit(); logger.info(f"User updated profile: {current_user.id}")
     return jsonify({"success":True,"message":"Profile updated"}),200
 
 # ---------------- Forgot / Reset Password ----------------
 @auth.route("/forgot-password", methods=["POST"])
+@limiter.limit("3/minute;20/day")
 def forgot_password():
-    validate_csrf(request.headers.get("X-CSRFToken"))
     data=request.get_json() or {}; email=data.get("email","").strip()
     user=User.query.filter_by(email=email).first()
     if not user: return jsonify({"success":False,"message":"Email not found"}),404
-    code="".join(random.choices("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ",k=6))
-    user.reset_code=code; user.reset_expires_at=datetime.utcnow()+timedelta(minutes=10)
+    code=generate_code()
+    user.reset_code=code; user.reset_expires_at=utcnow()+timedelta(minutes=10)
     db.session.commit()
-    mail.send(Message("Password Reset Code",recipients=[email],body=f"Code: {code}"))
+    send_email(Message("Password Reset Code",recipients=[email],body=f"Code: {code}"))
     return jsonify({"success":True}),200
 
 @auth.route("/reset-password-code", methods=["POST"])
+@limiter.limit("10/minute")
 def reset_password_code():
-    validate_csrf(request.headers.get("X-CSRFToken"))
     data=request.get_json() or {}; email,code,new_pw=data.get("email"),data.get("code"),data.get("new_password")
     user=User.query.filter_by(email=email).first()
-    if not user or user.reset_code!=code or user.reset_expires_at<datetime.utcnow():
+    if not user or user.reset_code!=code or user.reset_expires_at<utcnow():
         return jsonify({"success":False,"message":"Invalid reset"}),400
     if not strong_password(new_pw): return jsonify({"success":False,"message":"Weak password"}),400
-    user.password=generate_password_hash(new_pw); user.reset_code=None; user.reset_expires_at=None
+    user.password=hash_password(new_pw); user.reset_code=None; user.reset_expires_at=None
     db.session.commit()
     return jsonify({"success":True}),200
 
 @auth.route("/reset-password/<token>", methods=["POST"])
 def reset_password(token):
-    validate_csrf(request.headers.get("X-CSRFToken"))
     serializer=get_serializer()
     try: email=serializer.loads(token,salt="password-reset-salt",max_age=3600)
     except (SignatureExpired,BadSignature): return jsonify({"success":False,"message":"Invalid/expired token"}),400
@@ -214,7 +262,7 @@ def reset_password(token):
     if not strong_password(pw): return jsonify({"success":False,"message":"Weak password"}),400
     user=User.query.filter_by(email=email).first()
     if not user: return jsonify({"success":False,"message":"User not found"}),404
-    user.password=generate_password_hash(pw); db.session.commit()
+    user.password=hash_password(pw); db.session.commit()
     return jsonify({"success":True,"message":"Password reset ok"}),200
 
 # ---------------- CSRF error ----------------
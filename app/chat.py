@@ -2,34 +2,58 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_required, current_user
 from .models import ChatMessage, ChatSession, FavoriteImage, ImageRating
-from . import db, limiter
-from flask_wtf.csrf import validate_csrf
-import uuid, logging, time
-from datetime import datetime
+from . import db, limiter, utcnow, get_redis
+from sqlalchemy import select
+import uuid, logging, time, hashlib
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 chat = Blueprint("chat", __name__)
 
-# --- In-memory invalid prompt cache (fallback; better: Redis) ---
-recent_invalid_prompts = {}
+# --- Invalid prompt cache (Redis when configured, bounded in-memory fallback) ---
+recent_invalid_prompts = OrderedDict()  # key -> monotonic time marked, oldest first
 CACHE_TTL = 300  # 5 min
+CACHE_MAX_ENTRIES = 10000
+
+def _invalid_prompt_key(user_id, prompt):
+    digest = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+    return f"invalidprompt:{user_id}:{digest}"
+
+def _purge_expired_prompts(now):
+    while recent_invalid_prompts:
+        key, ts = next(iter(recent_invalid_prompts.items()))
+        if now - ts < CACHE_TTL and len(recent_invalid_prompts) <= CACHE_MAX_ENTRIES:
+            break
+        recent_invalid_prompts.popitem(last=False)
 
 def is_recently_invalid(user_id, prompt):
-    ts = recent_invalid_prompts.get(user_id, {}).get(prompt)
-    return bool(ts and (time.time() - ts) < CACHE_TTL)
+    key = _invalid_prompt_key(user_id, prompt)
+    r = get_redis()
+    if r is not None:
+        return bool(r.exists(key))
+    ts = recent_invalid_prompts.get(key)
+    return bool(ts and (time.monotonic() - ts) < CACHE_TTL)
 
 def mark_invalid(user_id, prompt):
-    recent_invalid_prompts.setdefault(user_id, {})[prompt] = time.time()
+    key = _invalid_prompt_key(user_id, prompt)
+    r = get_redis()
+    if r is not None:
+        r.set(key, 1, ex=CACHE_TTL)
+        return
+    now = time.monotonic()
+    # Re-marking restarts the TTL and moves the key to the back, keeping the dict in time order
+    recent_invalid_prompts[key] = now
+    recent_invalid_prompts.move_to_end(key)
+    _purge_expired_prompts(now)
 
 # --- Routes ---
 @chat.route("/new", methods=["POST"])
 @login_required
 def create_chat():
     try:
-        validate_csrf(request.headers.get("X-CSRFToken"))
         session_id = str(uuid.uuid4())
-        name = request.json.get("name", f"Chat {datetime.utcnow():%Y-%m-%d %H:%M:%S}")
-        chat_sess = ChatSession(uuid=session_id, user_id=current_user.id, name=name, created_at=datetime.utcnow())
+        name = request.json.get("name", f"Chat {utcnow():%Y-%m-%d %H:%M:%S}")
+        chat_sess = ChatSession(uuid=session_id, user_id=current_user.id, name=name, created_at=utcnow())
         db.session.add(chat_sess); db.session.commit()
         logger.info(f"New chat created uid={current_user.id} sid={session_id}")
         return jsonify({"session_id": session_id, "name": name}), 201
@@ -41,7 +65,6 @@ def create_chat():
 @login_required
 def rename_chat():
     try:
-        validate_csrf(request.headers.get("X-CSRFToken"))
         data=request.get_json() or {}
         sid,new_name=data.get("session_id"),data.get("name")
         if not sid or not new_name: return jsonify({"error":"Missing session_id or name"}),400
@@ -83,7 +106,6 @@ def delete_chat():
 @login_required
 def save_msg():
     try:
-        validate_csrf(request.headers.get("X-CSRFToken"))
         data=request.get_json() or {}
         msg, sid = data.get("message","").strip(), data.get("session_uuid")
         if not msg or not sid: return jsonify({"error":"Missing message/session"}),400
@@ -100,27 +122,34 @@ def save_msg():
 @chat.route("/session/<sid>")
 @login_required
 def get_session(sid):
-    session=ChatSession.query.filter_by(uuid=sid,user_id=current_user.id).first()
-    if not session: return jsonify({"error":"Not found"}),404
-    messages=ChatMessage.query.filter_by(session_id=sid).order_by(ChatMessage.timestamp.asc()).all()
-    return jsonify({"session_id":sid,"name":session.name,
-                    "messages":[{"id":m.id,"content":m.content,"image_url":m.image_url,"is_user":m.is_user,
-                                 "timestamp":m.timestamp.isoformat()} for m in messages]})
+    # One round trip: the session row outer-joined to its messages, pre-sorted by ix_chatmessage_session_ts.
+    # Read-only paths select plain columns; no ORM objects are built just to become dicts
+    rows=db.session.execute(select(ChatSession.name,ChatMessage.id,ChatMessage.content,ChatMessage.image_url,
+                                   ChatMessage.is_user,ChatMessage.timestamp)
+                            .outerjoin(ChatMessage,ChatMessage.session_id==ChatSession.uuid)
+                            .where(ChatSession.uuid==sid,ChatSession.user_id==current_user.id)
+                            .order_by(ChatMessage.timestamp.asc(),ChatMessage.id.asc())).mappings().all()
+    if not rows: return jsonify({"error":"Not found"}),404
+    messages=[{k:r[k] for k in ("id","content","image_url","is_user","timestamp")} for r in rows if r["id"] is not None]
+    return jsonify({"session_id":sid,"name":rows[0]["name"],"messages":messages})
 
 @chat.route("/history")
 @login_required
 def history():
-    sessions=ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.created_at.desc()).all()
-    data=[{"session_id":s.uuid,"title":s.name,"created_at":s.created_at.isoformat()} for s in sessions]
+    rows=db.session.execute(select(ChatSession.uuid,ChatSession.name,ChatSession.created_at)
+                            .where(ChatSession.user_id==current_user.id)
+                            .order_by(ChatSession.created_at.desc())).all()
+    data=[{"session_id":r.uuid,"title":r.name,"created_at":r.created_at} for r in rows]
     return jsonify({"sessions":data})
 
 @chat.route("/sessions")
 @login_required
 def list_sessions():
     page=int(request.args.get("page",1)); size=int(request.args.get("page_size",20))
-    sessions=ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.created_at.desc())\
-                              .limit(size).offset((page-1)*size).all()
-    return jsonify([{"session_id":s.uuid,"name":s.name,"created_at":s.created_at.isoformat()} for s in sessions])
+    rows=db.session.execute(select(ChatSession.uuid,ChatSession.name,ChatSession.created_at)
+                            .where(ChatSession.user_id==current_user.id).order_by(ChatSession.created_at.desc())
+                            .limit(size).offset((page-1)*size)).all()
+    return jsonify([{"session_id":r.uuid,"name":r.name,"created_at":r.created_at} for r in rows])
 
 @chat.route("/current-session")
 @login_required
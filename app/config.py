@@ -0,0 +1,85 @@
+# app/config.py
+import os
+from dataclasses import dataclass
+
+
+def _env_bool(name, default):
+    return os.getenv(name, default).lower() == 'true'
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """Environment settings, parsed and coerced once per create_app call."""
+    secret_key: str | None
+    database_path: str
+    run_create_all: str
+    db_pool_size: int
+    db_max_overflow: int
+    cors_origins: tuple[str, ...]
+    cors_max_age: int
+    mail_server: str | None
+    mail_port: int
+    mail_use_tls: bool
+    mail_username: str | None
+    mail_password: str | None
+    mail_default_sender: str | None
+    mail_workers: int
+    password_hash_method: str
+    colab_endpoint: str | None
+    backend_timeout: int
+    backend_total_budget: float
+    use_local_bert: bool
+    bert_workers: int
+    offline_mode: bool
+    redis_url: str | None
+    stats_flush_interval: float
+
+    @classmethod
+    def from_env(cls, default_db_path):
+        # Read at app creation rather than import time so load_dotenv() in main.py applies
+        return cls(
+            secret_key=os.getenv('SECRET_KEY'),
+            database_path=os.getenv('DATABASE_PATH', default_db_path),
+            run_create_all=os.getenv('RUN_CREATE_ALL', 'auto').lower(),
+            db_pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+            db_max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 5)),
+            cors_origins=tuple(os.getenv(
+                'CORS_ORIGINS', 'http://localhost:5000,http://127.0.0.1:5000'
+            ).split(',')),
+            cors_max_age=int(os.getenv('CORS_MAX_AGE', 86400)),
+            mail_server=os.getenv('MAIL_SERVER'),
+            mail_port=int(os.getenv('MAIL_PORT', 587)),
+            mail_use_tls=_env_bool('MAIL_USE_TLS', 'True'),
+            mail_username=os.getenv('MAIL_USERNAME'),
+            mail_password=os.getenv('MAIL_PASSWORD'),
+            mail_default_sender=os.getenv('MAIL_DEFAULT_SENDER'),
+            mail_workers=int(os.getenv('MAIL_WORKERS', 4)),
+            password_hash_method=os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1'),
+            colab_endpoint=os.getenv('COLAB_ENDPOINT'),
+            backend_timeout=int(os.getenv('BACKEND_TIMEOUT', 60)),
+            backend_total_budget=float(os.getenv('BACKEND_TOTAL_BUDGET', 75)),
+            use_local_bert=_env_bool('USE_LOCAL_BERT', 'False'),
+            bert_workers=int(os.getenv('BERT_WORKERS', 0)) or os.cpu_count() or 1,
+            offline_mode=_env_bool('OFFLINE_MODE', 'False'),
+            redis_url=os.getenv('REDIS_URL') or None,
+            stats_flush_interval=float(os.getenv('STATS_FLUSH_INTERVAL', 300)),
+        )
+
+    def flask_config(self):
+        """The subset of settings that Flask and its extensions read from app.config."""
+        return dict(
+            SECRET_KEY=self.secret_key,
+            MAIL_SERVER=self.mail_server,
+            MAIL_PORT=self.mail_port,
+            MAIL_USE_TLS=self.mail_use_tls,
+            MAIL_USERNAME=self.mail_username,
+            MAIL_PASSWORD=self.mail_password,
+            MAIL_DEFAULT_SENDER=self.mail_default_sender,
+            PASSWORD_HASH_METHOD=self.password_hash_method,
+            COLAB_ENDPOINT=self.colab_endpoint,
+            BACKEND_TIMEOUT=self.backend_timeout,
+            BACKEND_TOTAL_BUDGET=self.backend_total_budget,
+            USE_LOCAL_BERT=self.use_local_bert,
+            BERT_WORKERS=self.bert_workers,
+            OFFLINE_MODE=self.offline_mode,
+        )
@@ -2,6 +2,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from sqlalchemy.sql import func
 from datetime import datetime
+from uuid import uuid4
 
 db = SQLAlchemy()
 
@@ -10,7 +11,7 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(120), nullable=False)
+    password = db.Column(db.String(255), nullable=False)  # scrypt hashes exceed 120 chars
     designs_created = db.Column(db.Integer, default=0)
     designs_shared = db.Column(db.Integer, default=0)
     is_verified = db.Column(db.Boolean, default=False)
@@ -40,31 +41,47 @@ class UserStyle(db.Model):
     style_name = db.Column(db.String(50), nullable=False)
     count = db.Column(db.Integer, default=1)
 
+    __table_args__ = (
+        # Unique index rather than a constraint so it can be added to existing tables; backs the upsert
+        db.Index('uq_userstyle_user_style', 'user_id', 'style_name', unique=True),
+    )
+
     def __repr__(self):
         return f"<UserStyle {self.style_name} x{self.count}>"
 
 
 class ChatSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    uuid = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    uuid = db.Column(db.String(36), unique=True, nullable=False, index=True, default=lambda: str(uuid4()))
     name = db.Column(db.String(100), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
 
-    messages  = db.relationship('ChatMessage', back_populates='session_obj', lazy=True, cascade="all, delete-orphan")
+    # lazy="raise": load explicitly with selectinload() so listing endpoints can't N+1
+    messages  = db.relationship('ChatMessage', back_populates='session_obj', lazy="raise", cascade="all, delete-orphan",
+                                order_by='ChatMessage.timestamp')
     favorites = db.relationship('FavoriteImage', back_populates='session', lazy=True, cascade="all, delete-orphan")
     ratings   = db.relationship('ImageRating', back_populates='session', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index('ix_chatsession_user_created', 'user_id', 'created_at'),
+    )
+
     def __repr__(self):
         return f"<ChatSession {self.uuid} for User {self.user_id}>"
 
 
+# Only this many trailing characters of ChatMessage.image_url are indexed: generated URLs share
+# a long prefix and differ in the filename at the end, so the tail is selective and bounded
+IMAGE_URL_INDEX_TAIL = 64
+
+
 class ChatMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     is_user = db.Column(db.Boolean, default=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
-    session_id = db.Column(db.String(64), db.ForeignKey('chat_session.uuid'), nullable=False, index=True)
+    session_id = db.Column(db.String(36), db.ForeignKey('chat_session.uuid'), nullable=False, index=True)
     timestamp = db.Column(db.DateTime(timezone=True), server_default=func.now())
     image_url = db.Column(db.Text, nullable=True)
     source = db.Column(db.String(20), default='api')
@@ -73,6 +90,12 @@ class ChatMessage(db.Model):
 
     session_obj = db.relationship('ChatSession', back_populates='messages', primaryjoin="ChatMessage.session_id == ChatSession.uuid")
 
+    __table_args__ = (
+        db.Index('ix_chatmessage_user_ts', 'user_id', 'timestamp'),
+        db.Index('ix_chatmessage_imageurl_tail_ts', func.substr(image_url, -IMAGE_URL_INDEX_TAIL), 'timestamp'),
+        db.Index('ix_chatmessage_session_ts', 'session_id', 'timestamp'),
+    )
+
     def __repr__(self):
         return f"<ChatMessage by User {self.user_id} at {self.timestamp}>"
 
@@ -80,7 +103,7 @@ class ChatMessage(db.Model):
 class FavoriteImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
-    session_id = db.Column(db.String(64), db.ForeignKey('chat_session.uuid'), nullable=True, index=True)  # NEW
+    session_id = db.Column(db.String(36), db.ForeignKey('chat_session.uuid'), nullable=True, index=True)  # NEW
     image_url = db.Column(db.String(500), nullable=False, index=True)
     prompt = db.Column(db.Text, nullable=False)
     style_name = db.Column(db.String(100), nullable=True)
@@ -90,6 +113,7 @@ class FavoriteImage(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('user_id', 'image_url', name='unique_favorite_per_user'),
+        db.Index('ix_favoriteimage_user_ts', 'user_id', 'timestamp'),
     )
 
     def __repr__(self):
@@ -99,7 +123,7 @@ class FavoriteImage(db.Model):
 class ImageRating(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
-    session_id = db.Column(db.String(64), db.ForeignKey('chat_session.uuid'), nullable=True, index=True)  # NEW
+    session_id = db.Column(db.String(36), db.ForeignKey('chat_session.uuid'), nullable=True, index=True)  # NEW
     image_url = db.Column(db.String(500), nullable=False, index=True)
     prompt_relevance = db.Column(db.Integer, nullable=False)
     image_quality = db.Column(db.Integer, nullable=False)
@@ -109,6 +133,10 @@ class ImageRating(db.Model):
 
     session = db.relationship('ChatSession', back_populates='ratings')
 
+    __table_args__ = (
+        db.Index('ix_imagerating_user_ts', 'user_id', 'timestamp'),
+    )
+
     def __repr__(self):
         return f"<ImageRating {self.image_url} by User {self.user_id}>"
 
@@ -156,12 +184,17 @@ class SUSFeedback(db.Model):
 
     user = db.relationship('User', back_populates='sus_feedback', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_susfeedback_user_ts', 'user_id', 'timestamp'),
+        db.Index('ix_susfeedback_ts', 'timestamp'),
+        db.Index('ix_susfeedback_usertype_ts', 'user_type', 'timestamp'),
+        db.Index('ix_susfeedback_score', 'sus_score'),
+    )
+
     def __repr__(self):
         return f"<SUSFeedback by User {self.user_id} at {self.timestamp} - Score: {self.sus_score}>"
 
     @staticmethod
     def calculate_sus_score(q1, q2, q3, q4, q5, q6, q7, q8, q9, q10):
-        odd_scores = [q1 - 1, q3 - 1, q5 - 1, q7 - 1, q9 - 1]
-        even_scores = [5 - q2, 5 - q4, 5 - q6, 5 - q8, 5 - q10]
-        total = sum(odd_scores + even_scores) * 2.5
-        return total
+        # Constant-folded form of sum(odd - 1) + sum(5 - even), times 2.5
+        return 2.5 * (q1 + q3 + q5 + q7 + q9 - q2 - q4 - q6 - q8 - q10 + 20)
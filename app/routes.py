@@ -1,29 +1,182 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, jsonify, request, current_app, abort, make_response, after_this_request
 from flask_login import login_required, current_user
-from datetime import datetime
-from markupsafe import escape
-from flask_cors import CORS
+from sqlalchemy import select, update, case, insert, literal, exists, func
 import logging
+import threading
+import time
+import uuid
 
-from . import db, csrf, limiter
+from . import db, csrf, limiter, utcnow, get_redis
+from .chat import is_recently_invalid, mark_invalid
 from .models import (
-    UserStyle, ChatMessage, ChatSession,
-    FavoriteImage, ImageRating, StyleFeedback, PromptFeedback
+    User, UserStyle, ChatMessage, ChatSession,
+    FavoriteImage, ImageRating, StyleFeedback, PromptFeedback, IMAGE_URL_INDEX_TAIL
 )
-from .services.bert_validation import validate_prompt_locally, format_bot_message
 
 logger = logging.getLogger(__name__)
 api = Blueprint("api", __name__)
-CORS(api)
+
+FAVORITE_STYLES_TTL = 300  # safety net; generate_image deletes the key when counts change
+STATS_FLUSH_EVERY = 20  # buffered counter changes per user before they're written to the row
 
 
 # ------------------------------
 # Helpers
 # ------------------------------
-def sanitize_input(text):
+def sanitize_input(text, max_len=None):
+    """Strip and length-check a JSON string field. No HTML escaping here: values are
+    stored raw and escaped where they're rendered (Jinja autoescape, escapeHTML in script.js)."""
     if not text or not isinstance(text, str):
         return ""
-    return escape(text).strip()
+    text = text.strip()
+    if max_len is not None and len(text) > max_len:
+        abort(make_response(jsonify({"success": False, "message": f"Field exceeds {max_len} characters"}), 400))
+    return text
+
+
+def upsert_insert(model):
+    """Dialect INSERT construct for `model` that supports ON CONFLICT clauses."""
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
+def increment_user_style(user_id, style_name):
+    """Single-statement INSERT ... ON CONFLICT DO UPDATE on (user_id, style_name)."""
+    stmt = upsert_insert(UserStyle).values(user_id=user_id, style_name=style_name, count=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "style_name"], set_={"count": UserStyle.count + 1}
+    )
+    db.session.execute(stmt)
+
+
+_REASON_PREFIXES = ("🔹 1. ", "🔹 2. ", "🔹 3. ")
+
+
+def format_style_reasons(reasons):
+    """Numbered list of the top three style reasons for the assistant reply."""
+    return "\n".join(
+        prefix + r[:1].upper() + r[1:] for prefix, r in zip(_REASON_PREFIXES, reasons)
+    ) or "Timeless design elements"
+
+
+def insert_owned_message(session_id, user_id, content, is_user):
+    """INSERT ... SELECT guarded by session ownership; returns the new message id, or None if
+    the session doesn't exist or belongs to someone else."""
+    owned = select(literal(session_id), literal(user_id), literal(content), literal(is_user)).where(
+        exists().where(ChatSession.uuid == session_id, ChatSession.user_id == user_id)
+    )
+    stmt = (
+        insert(ChatMessage)
+        .from_select(["session_id", "user_id", "content", "is_user"], owned)
+        .returning(ChatMessage.id)
+    )
+    return db.session.execute(stmt).scalar()
+
+
+def _clamped_add(column, delta):
+    return case((column + delta < 0, 0), else_=column + delta)
+
+
+def bump_user_stat(user_id, field, delta=1):
+    """Add delta to a User counter (designs_created/designs_shared), never going below zero.
+
+    With Redis configured the change is buffered in a per-user hash and folded into the
+    row every STATS_FLUSH_EVERY changes (and by the periodic flusher), instead of an UPDATE
+    on the user row per request. Otherwise it's a SQL-side UPDATE, so the (possibly
+    expired) user object isn't reloaded.
+    """
+    r = get_redis()
+    if r is None:
+        db.session.execute(
+            update(User).where(User.id == user_id).values({field: _clamped_add(getattr(User, field), delta)})
+        )
+        return
+    if abs(r.hincrby(f"user:{user_id}:stats", field, delta)) >= STATS_FLUSH_EVERY:
+        # After the view has committed, so the flush's own transaction doesn't wait on its lock
+        @after_this_request
+        def _flush_stats(response):
+            flush_user_stats(user_id)
+            return response
+
+
+# Move the buffered hash to a per-flush claim key in one step, so concurrent flushes
+# take disjoint sets of deltas and increments made meanwhile start a fresh hash
+_CLAIM_STATS = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return {} end
+redis.call('RENAME', KEYS[1], KEYS[2])
+return redis.call('HGETALL', KEYS[2])
+"""
+
+# Hand a claim that couldn't be written back to the live hash
+_RESTORE_STATS = """
+local fields = redis.call('HGETALL', KEYS[2])
+for i = 1, #fields, 2 do
+    redis.call('HINCRBY', KEYS[1], fields[i], fields[i + 1])
+end
+redis.call('DEL', KEYS[2])
+"""
+
+
+def flush_user_stats(user_id):
+    """Apply buffered counter deltas to the user row; returns True if the row changed.
+
+    The deltas are claimed atomically and only dropped from Redis once the UPDATE has
+    committed in its own transaction; if it fails they go back to the live hash.
+    """
+    r = get_redis()
+    if r is None:
+        return False
+    key = f"user:{user_id}:stats"
+    claim = f"{key}:flushing:{uuid.uuid4().hex}"
+    fields = r.register_script(_CLAIM_STATS)(keys=[key, claim])
+    values = {}
+    for field, delta in zip(fields[::2], fields[1::2]):
+        field, delta = field.decode() if isinstance(field, bytes) else field, int(delta)
+        if delta:
+            values[field] = _clamped_add(getattr(User, field), delta)
+    if not values:
+        r.delete(claim)
+        return False
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(update(User).where(User.id == user_id).values(**values))
+    except Exception:
+        logger.exception("Could not flush buffered stats for user %s", user_id)
+        r.register_script(_RESTORE_STATS)(keys=[key, claim])
+        return False
+    r.delete(claim)
+    return True
+
+
+def flush_all_user_stats():
+    """Flush every user's buffered counters; run by the periodic flusher, not per request."""
+    r = get_redis()
+    if r is None:
+        return False
+    flushed = False
+    for key in r.scan_iter(match="user:*:stats", count=500):
+        key = key.decode() if isinstance(key, bytes) else key
+        user_id = key.split(":")[1]
+        if user_id.isdigit():
+            flushed = flush_user_stats(int(user_id)) or flushed
+    return flushed
+
+
+def start_stats_flusher(app, interval):
+    """Fold buffered counters into the user rows every interval seconds in a daemon thread."""
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    flush_all_user_stats()
+                except Exception:
+                    logger.exception("Periodic user stats flush failed")
+
+    threading.Thread(target=run, name="stats-flush", daemon=True).start()
 
 
 def shorten_url(url: str, max_len: int = 60) -> str:
@@ -39,16 +192,26 @@ def shorten_url(url: str, max_len: int = 60) -> str:
 # Health check
 # ------------------------------
 @api.route("/health", methods=["GET"])
+@limiter.exempt  # polled by liveness/readiness probes; answering costs no backend call
 def unified_health_check():
-    """Basic system & backend health info"""
+    """Basic system & backend health info, read from cached state rather than re-probed"""
     try:
-        backend_url = current_app.config.get("COLAB_ENDPOINT")
+        config = current_app.config
+        backend_url = config.get("COLAB_ENDPOINT")
         backend_health = "not configured"
         backend_connected = False
+        last_checked = None
 
         if backend_url:
             try:
-                backend_connected = current_app.backend_service._test_connection()
+                if "BACKEND_LAST_CHECKED" in config:
+                    # Kept current by main.py's background health monitor
+                    backend_connected = config.get("BACKEND_AVAILABLE", False)
+                    last_checked = config["BACKEND_LAST_CHECKED"]
+                else:
+                    # No monitor (e.g. `flask run`): the service's probe result is cached,
+                    # so frequent polling still reaches the backend at most every few seconds
+                    backend_connected = current_app.backend_service._test_connection()
                 backend_health = "healthy" if backend_connected else "unhealthy"
             except Exception as e:
                 backend_health = f"error ({e})"
@@ -56,11 +219,12 @@ def unified_health_check():
         return jsonify(
             {
                 "status": "healthy",
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": utcnow(),
                 "backend": {
                     "configured": bool(backend_url),
                     "connected": backend_connected,
                     "health": backend_health,
+                    "last_checked": last_checked,
                     "url": backend_url or "not set",
                 },
             }
@@ -75,6 +239,9 @@ def unified_health_check():
 # ------------------------------
 @api.route("/api/validate-prompt", methods=["POST"])
 def validate_prompt():
+    # Imported lazily: loading BERT pulls in torch/transformers
+    from .services.bert_validation import validate_prompt_locally, format_bot_message
+
     prompt = request.json.get("prompt", "")
     result = validate_prompt_locally(prompt)
     bot_message = format_bot_message(result)
@@ -100,41 +267,48 @@ def generate_image():
         prompt = data.get("prompt", "").strip()
         style = data.get("style", "")
         session_id = data.get("session_id")
+        # Captured up front: current_user is expired by the commit below and would be re-SELECTed
+        user_id = current_user.id
 
         if not prompt:
             return jsonify({"error": "No prompt provided"}), 400
 
+        # Resubmitting a prompt that just failed validation skips the validator round trip
+        if is_recently_invalid(user_id, prompt):
+            message = "This prompt was rejected moments ago. Please rephrase it and try again."
+            return jsonify({"error": message, "validation": {"valid": False, "message": message}}), 400
+
         validation_result, validation_error = current_app.backend_service.validate_prompt(prompt)
         if validation_error:
             return jsonify({"error": f"Prompt validation failed: {validation_error}"}), 400
 
         # Ensure session exists
         if not session_id:
-            new_session = ChatSession(user_id=current_user.id, name=f"Chat {datetime.utcnow()}")
+            new_session = ChatSession(user_id=user_id, name=f"Chat {utcnow()}")
             db.session.add(new_session)
             db.session.flush()
             session_id = new_session.uuid
             logger.info(f"Created new session: {session_id}")
 
-        session_check = ChatSession.query.filter_by(uuid=session_id, user_id=current_user.id).first()
-        if not session_check:
+        # Ownership check and user-prompt insert in one statement; committed before the
+        # backend call so SQLite's write lock isn't held while the image generates
+        if insert_owned_message(session_id, user_id, prompt, True) is None:
+            db.session.rollback()
             return jsonify({"error": "Invalid or unauthorized session"}), 403
+        db.session.commit()
 
         # Handle invalid prompt
         if not validation_result or not validation_result.get("valid"):
             message = validation_result.get("message", "Prompt validation failed")
-            db.session.add(ChatMessage(session_id=session_id, user_id=current_user.id, content=prompt, is_user=True))
-            db.session.add(ChatMessage(session_id=session_id, user_id=current_user.id, content=message, is_user=False))
+            mark_invalid(user_id, prompt)
+            db.session.add(ChatMessage(session_id=session_id, user_id=user_id, content=message, is_user=False))
             db.session.commit()
             return jsonify({"error": message, "validation": validation_result}), 400
 
         final_style = style if style and style != "auto" else validation_result.get("detected_style", "modern")
         style_reasons = validation_result.get("style_reasons", [])
 
-        # Save user prompt
-        db.session.add(ChatMessage(session_id=session_id, user_id=current_user.id, content=prompt, is_user=True))
-
-        # Call backend
+        # Call backend (no pooled connection is checked out while this runs)
         result, generation_error = current_app.backend_service.generate_image(prompt, final_style)
         if generation_error or not result.get("image_url"):
             return jsonify({"error": generation_error or "No image URL returned"}), 500
@@ -142,7 +316,7 @@ def generate_image():
         image_url = result["image_url"]
 
         # Save assistant response
-        explanation = "\n".join([f"🔹 {i+1}. {r.capitalize()}" for i, r in enumerate(style_reasons[:3])]) or "Timeless design elements"
+        explanation = format_style_reasons(style_reasons)
         message = (
             f"🎨 Here is your generated design in **{final_style.capitalize()}** style!\n\n"
             f"🔍 **Why this style?**\n{explanation}\n\n"
@@ -151,7 +325,7 @@ def generate_image():
         db.session.add(
             ChatMessage(
                 session_id=session_id,
-                user_id=current_user.id,
+                user_id=user_id,
                 content=message,
                 is_user=False,
                 image_url=image_url,
@@ -161,15 +335,14 @@ def generate_image():
         )
 
         # Update stats
-        current_user.designs_created += 1
-        user_style = UserStyle.query.filter_by(user_id=current_user.id, style_name=final_style).first()
-        if user_style:
-            user_style.count += 1
-        else:
-            db.session.add(UserStyle(user_id=current_user.id, style_name=final_style))
-
+        bump_user_stat(user_id, "designs_created")
+        increment_user_style(user_id, final_style)
         db.session.commit()
 
+        r = get_redis()
+        if r is not None:
+            r.delete(f"favstyles:{user_id}")
+
         return jsonify({"image": image_url, "message": message, "style": final_style})
 
     except Exception as e:
@@ -188,6 +361,8 @@ def detect_style():
     if not prompt:
         return jsonify({"error": "Prompt is required"}), 400
 
+    from .services.bert_validation import validate_prompt_locally
+
     result = validate_prompt_locally(prompt)
     return jsonify({"style": result.get("detected_style")})
 
@@ -198,10 +373,20 @@ def detect_style():
 @api.route("/favorite-styles", methods=["GET"])
 @login_required
 def get_favorite_styles():
+    r = get_redis()
+    key = f"favstyles:{current_user.id}"
+    if r is not None:
+        cached = r.get(key)
+        if cached is not None:
+            return current_app.response_class(cached, mimetype="application/json")
+
     styles = (
         UserStyle.query.filter_by(user_id=current_user.id).order_by(UserStyle.count.desc()).limit(3).all()
     )
-    return jsonify({"styles": [{"style_name": s.style_name, "count": s.count} for s in styles]})
+    payload = {"styles": [{"style_name": s.style_name, "count": s.count} for s in styles]}
+    if r is not None:
+        r.setex(key, FAVORITE_STYLES_TTL, current_app.json.dumps(payload))
+    return jsonify(payload)
 
 
 # ------------------------------
@@ -213,7 +398,7 @@ def share_design():
     data = request.get_json() or {}
     if not data.get("image_url"):
         return jsonify({"error": "Image URL is required"}), 400
-    current_user.designs_shared += 1
+    bump_user_stat(current_user.id, "designs_shared")
     db.session.commit()
     return jsonify({"success": True})
 
@@ -228,44 +413,46 @@ def add_favorite():
     data = request.get_json() or {}
     image_url = sanitize_input(data.get("image_url"))
     prompt = sanitize_input(data.get("prompt"))
-    style_name = sanitize_input(data.get("style_name"))
+    style_name = sanitize_input(data.get("style_name"), max_len=100)
 
     if not image_url or not prompt:
         return jsonify({"success": False, "message": "Image URL and prompt are required"}), 400
 
-    existing = FavoriteImage.query.filter_by(user_id=current_user.id, image_url=image_url).first()
-    if existing:
+    # unique_favorite_per_user turns a duplicate into "no row returned" instead of a prior SELECT
+    stmt = (
+        upsert_insert(FavoriteImage)
+        .values(user_id=current_user.id, image_url=image_url, prompt=prompt, style_name=style_name)
+        .on_conflict_do_nothing(index_elements=["user_id", "image_url"])
+        .returning(FavoriteImage.id)
+    )
+    favorite_id = db.session.execute(stmt).scalar()
+    if favorite_id is None:
+        db.session.rollback()
         return jsonify({"success": True, "message": "Already in favorites"}), 200
 
-    favorite = FavoriteImage(user_id=current_user.id, image_url=image_url, prompt=prompt, style_name=style_name)
-    db.session.add(favorite)
-    current_user.designs_shared += 1
+    bump_user_stat(current_user.id, "designs_shared")
     db.session.commit()
-    return jsonify({"success": True, "favorite_id": favorite.id}), 201
+    return jsonify({"success": True, "favorite_id": favorite_id}), 201
 
 
 @api.route("/favorites", methods=["GET"])
 @login_required
 def get_favorites():
-    page = max(int(request.args.get("page", 1)), 1)
+    # Keyset pagination on id (insert order == timestamp order): ?before=<next_cursor> from the previous page
     size = max(min(int(request.args.get("page_size", 20)), 50), 1)
-    q = FavoriteImage.query.filter_by(user_id=current_user.id).order_by(FavoriteImage.timestamp.desc())
-    total = q.count()
-    favorites = q.offset((page - 1) * size).limit(size).all()
+    q = select(
+        FavoriteImage.id, FavoriteImage.image_url, FavoriteImage.style_name, FavoriteImage.prompt, FavoriteImage.timestamp
+    ).where(FavoriteImage.user_id == current_user.id)
+    before = request.args.get("before", type=int)
+    if before:
+        q = q.where(FavoriteImage.id < before)
+    rows = db.session.execute(q.order_by(FavoriteImage.id.desc()).limit(size + 1)).mappings().all()
+    favorites = rows[:size]
+    next_cursor = favorites[-1]["id"] if len(rows) > size else None
     return jsonify(
         {
-            "page": page,
-            "total": total,
-            "favorites": [
-                {
-                    "id": f.id,
-                    "image_url": f.image_url,
-                    "style_name": f.style_name,
-                    "prompt": f.prompt,
-                    "timestamp": f.timestamp.isoformat(),
-                }
-                for f in favorites
-            ],
+            "next_cursor": next_cursor,
+            "favorites": [dict(f) for f in favorites],
         }
     )
 
@@ -277,8 +464,7 @@ def remove_favorite(favorite_id):
     if not favorite:
         return jsonify({"success": False, "message": "Favorite not found"}), 404
     db.session.delete(favorite)
-    if current_user.designs_shared > 0:
-        current_user.designs_shared -= 1
+    bump_user_stat(current_user.id, "designs_shared", -1)
     db.session.commit()
     return jsonify({"success": True})
 
@@ -304,8 +490,14 @@ def rate_image():
         db.session.commit()
         return jsonify({"success": True, "message": "Rating updated"}), 200
 
-    chat_msg = ChatMessage.query.filter_by(image_url=image_url).order_by(ChatMessage.timestamp.desc()).first()
-    style_tag = chat_msg.detected_style if chat_msg else None
+    # Match on the indexed URL tail, then confirm the full URL here: an image_url = ? term in
+    # the same WHERE lets SQLite fold the tail expression into a constant and skip the index
+    candidates = db.session.execute(
+        select(ChatMessage.detected_style, ChatMessage.image_url)
+        .where(func.substr(ChatMessage.image_url, -IMAGE_URL_INDEX_TAIL) == image_url[-IMAGE_URL_INDEX_TAIL:])
+        .order_by(ChatMessage.timestamp.desc())
+    )
+    style_tag = next((style for style, url in candidates if url == image_url), None)
 
     rating = ImageRating(
         user_id=current_user.id,
@@ -323,19 +515,28 @@ def rate_image():
 @api.route("/ratings", methods=["GET"])
 @login_required
 def get_ratings():
-    ratings = ImageRating.query.filter_by(user_id=current_user.id).all()
+    rows = db.session.execute(
+        select(
+            ImageRating.image_url,
+            ImageRating.prompt_relevance,
+            ImageRating.image_quality,
+            ImageRating.style_accuracy,
+            ImageRating.style_tag,
+            ImageRating.timestamp,
+        ).where(ImageRating.user_id == current_user.id)
+    ).mappings().all()
     return jsonify(
         {
             "ratings": [
                 {
-                    "image_url": r.image_url,
-                    "prompt_relevance": r.prompt_relevance,
-                    "image_quality": r.image_quality,
-                    "style_accuracy": r.style_accuracy,
-                    "style_tag": r.style_tag,
-                    "created_at": r.timestamp.isoformat() if r.timestamp else None,
+                    "image_url": r["image_url"],
+                    "prompt_relevance": r["prompt_relevance"],
+                    "image_quality": r["image_quality"],
+                    "style_accuracy": r["style_accuracy"],
+                    "style_tag": r["style_tag"],
+                    "created_at": r["timestamp"],
                 }
-                for r in ratings
+                for r in rows
             ]
         }
     )
@@ -348,7 +549,7 @@ def get_ratings():
 @login_required
 def get_style_explanation():
     data = request.get_json() or {}
-    style = sanitize_input(data.get("style"))
+    style = sanitize_input(data.get("style"), max_len=100)
     if not style:
         return jsonify({"error": "Style is required"}), 400
     explanation, error = current_app.backend_service.get_style_explanation(style)
@@ -361,8 +562,8 @@ def get_style_explanation():
 @login_required
 def submit_style_feedback():
     data = request.get_json() or {}
-    orig = sanitize_input(data.get("original_style"))
-    corr = sanitize_input(data.get("corrected_style"))
+    orig = sanitize_input(data.get("original_style"), max_len=100)
+    corr = sanitize_input(data.get("corrected_style"), max_len=100)
     if not orig or not corr:
         return jsonify({"error": "Both original and corrected style required"}), 400
     fb = StyleFeedback(user_id=current_user.id, image_url=data.get("image_url", ""), original_style=orig, corrected_style=corr)
@@ -380,7 +581,7 @@ def prompt_feedback():
     if not prompt or not feedback:
         return jsonify({"error": "Prompt and feedback required"}), 400
 
-    fb = PromptFeedback(user_id=current_user.id, prompt=prompt, feedback=feedback, category=category, timestamp=datetime.utcnow())
+    fb = PromptFeedback(user_id=current_user.id, prompt=prompt, feedback=feedback, category=category, timestamp=utcnow())
     db.session.add(fb)
     db.session.commit()
     return jsonify({"success": True})
@@ -1,43 +1,228 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
+import base64
+import binascii
+import concurrent.futures
+import hashlib
 import logging
-import json
+import multiprocessing
+import os
+import orjson
+import random
 import time
+import threading
+from types import MappingProxyType
+from collections import OrderedDict
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
 from flask import current_app, has_app_context
-from .bert_validation import validate_prompt_locally
 
 logger = logging.getLogger(__name__)
 
+# Error code returned by _send_request when the endpoint cannot be reached at all
+BACKEND_UNREACHABLE = "backend_unreachable"
+UNAVAILABLE_MESSAGE = "Backend service is currently unavailable. Please try again later."
+
+# Statuses worth retrying; 503 and 429 may carry a Retry-After hint
+RETRY_STATUSES = frozenset((429, 502, 503, 504))
+MAX_BACKOFF = 30.0
+
+
+def _retry_after_seconds(response):
+    """Parse a Retry-After header (delta-seconds or HTTP-date), or None if absent/invalid."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+# Upper bound on one local BERT validation, including any wait for a free worker
+BERT_TIMEOUT = 10
+
+
+def _load_bert_model():
+    """Worker initializer: load the model once per process before any prompt arrives."""
+    from . import bert_validation  # noqa: F401
+
+
+def _validate_in_worker(prompt):
+    # Module-level so it pickles by reference without importing BERT into the web process
+    from .bert_validation import validate_prompt_locally
+
+    return validate_prompt_locally(prompt)
+
+
+@lru_cache(maxsize=64)
+def _payload_template(style, guidance_scale, negative_prompt, num_inference_steps):
+    """The /generate fields that don't vary per prompt, as an immutable tuple of pairs."""
+    fields = []
+    if style and style != "auto":
+        fields.append(("style", style))
+    if negative_prompt:
+        fields.append(("negative_prompt", negative_prompt))
+    if guidance_scale:
+        fields.append(("guidance_scale", guidance_scale))
+    if num_inference_steps:
+        fields.append(("num_inference_steps", num_inference_steps))
+    return tuple(fields)
+
+
+class CircuitBreaker:
+    """CLOSED -> OPEN after `fail_max` consecutive failures; OPEN fails fast for `reset_timeout`
+    seconds, then HALF_OPEN lets a single probe through to decide between CLOSED and OPEN."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, fail_max=5, reset_timeout=30.0):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.fail_count = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.fail_count = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.fail_count += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.fail_count >= self.fail_max:
+                if self.state != self.OPEN:
+                    logger.warning(f"⚡ Backend circuit opened after {self.fail_count} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
 
 class BackendService:
+    JSON_HEADERS = MappingProxyType({"Content-Type": "application/json"})
+    HEALTH_TIMEOUT = (2.0, 2.0)
+
     def __init__(self, app=None):
         self.app = app
         self.use_local_validation = False
-        self.base_url = None
+        self._bert_pool = None
+        self._set_base_url(None)
+        self.image_dir = None
+        self.image_url_prefix = "/static/generated"
+        self.request_timeout = 60
+        self.total_budget_s = 75.0
+
+        # One pooled session per service: keep-alive sockets skip the TCP+TLS handshake per call
+        self.session = requests.Session()
+        # Failed connects are retried inside the pool: nothing was sent yet, so even a POST is
+        # safe to repeat. Status and timeout retries stay in _send_request, which needs to see
+        # each attempt for the circuit breaker, Retry-After and the time budget.
+        connect_retry = Retry(total=2, connect=2, read=False, backoff_factor=0.25)
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=connect_retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"ngrok-skip-browser-warning": "1"})
+        atexit.register(self.close)
+
+        # Only 5xx responses, timeouts and connection errors count against the backend
+        self._breaker = CircuitBreaker(fail_max=5, reset_timeout=30.0)
+
+        # (monotonic timestamp, ok) of the last health probe, reused while fresh
+        self._health_cache_ttl = 10.0
+        self._health_cache = (0.0, False)
+
+        # Successful results keyed by request hash, plus in-flight calls that
+        # identical concurrent requests wait on instead of hitting the backend again
+        self._result_cache = OrderedDict()
+        self._result_cache_size = 512
+        self._result_cache_ttl = 300.0
+        self._inflight = {}
+        self._cache_lock = threading.Lock()
 
         if app:
             self.init_app(app)
 
     def init_app(self, app):
+        # Per-attempt timeout, and the wall-clock budget for a whole call including retries
+        self.request_timeout = app.config.get("BACKEND_TIMEOUT", 60)
+        self.total_budget_s = app.config.get("BACKEND_TOTAL_BUDGET", 75.0)
+
+        # Base64 images from the backend are written here and served as static files
+        if app.static_folder:
+            self.image_dir = os.path.join(app.static_folder, "generated")
+            self.image_url_prefix = f"{app.static_url_path}/generated"
+
         # Enable local BERT if configured
         self.use_local_validation = app.config.get("USE_LOCAL_BERT", False)
         if self.use_local_validation:
             logger.info("✅ Using local BERT validation")
+            if self._bert_pool is None:
+                # Inference is CPU-bound; separate processes keep it off the request threads'
+                # GIL. Spawned, not forked, so workers don't inherit the web process's threads.
+                self._bert_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=app.config.get("BERT_WORKERS") or os.cpu_count() or 1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_load_bert_model,
+                )
 
         # Always configure base_url for remote image generation
-        backend_url = app.config.get("COLAB_ENDPOINT", "").rstrip("/")
+        backend_url = (app.config.get("COLAB_ENDPOINT") or "").rstrip("/")
         if backend_url:
-            self.base_url = backend_url
+            self._set_base_url(backend_url)
             logger.info(f"✅ Colab endpoint set for image generation: {self.base_url}")
 
-            if not self._test_connection():
-                logger.error("❌ Failed to connect to backend service at COLAB_ENDPOINT")
-                return False
+            # Probe in the background: startup isn't blocked, and the TLS handshake is
+            # already done by the time the first user request needs the connection
+            threading.Thread(target=self._warmup, name="backend-warmup", daemon=True).start()
         else:
-            self.base_url = None
+            self._set_base_url(None)
             logger.warning("⚠️ COLAB_ENDPOINT not configured — image generation will be disabled")
 
         return True
 
+    def _warmup(self):
+        if not self._test_connection():
+            logger.error("❌ Failed to connect to backend service at COLAB_ENDPOINT")
+
+    def _set_base_url(self, base_url):
+        # Endpoint URLs are built once here instead of on every call
+        self.base_url = base_url
+        self._health_url = f"{base_url}/health" if base_url else None
+        self._generate_url = f"{base_url}/generate" if base_url else None
+        self._validate_url = f"{base_url}/validate_prompt" if base_url else None
+
+    def close(self):
+        """Release pooled connections and BERT worker processes."""
+        self.session.close()
+        if self._bert_pool is not None:
+            self._bert_pool.shutdown(wait=False, cancel_futures=True)
+            self._bert_pool = None
+
     def _ensure_base_url(self):
         """Ensure base_url is always up-to-date from app context if needed."""
         if not self.base_url and not self.use_local_validation:
@@ -51,78 +236,166 @@ class BackendService:
         if not self.base_url:
             logger.warning("❌ Cannot test connection: Backend URL not configured")
             return False
+        return self._probe(ttl=self._health_cache_ttl)
+
+    def _probe(self, ttl=10.0):
+        """Backend health, re-probed only when the cached result is older than `ttl` seconds."""
+        checked_at, ok = self._health_cache
+        if checked_at and time.monotonic() - checked_at < ttl:
+            return ok
+        ok = self._probe_health()
+        self._health_cache = (time.monotonic(), ok)
+        return ok
+
+    def _invalidate_health(self):
+        self._health_cache = (0.0, False)
+
+    def _probe_health(self):
         try:
-            health_url = f"{self.base_url}/health"
-            headers = {"ngrok-skip-browser-warning": "1"}
-            response = requests.get(health_url, headers=headers, timeout=10)
+            # HEAD skips the body; (connect, read) timeouts keep a dead tunnel from stalling us
+            response = self.session.head(self._health_url, timeout=self.HEALTH_TIMEOUT)
+            if response.status_code == 405:
+                # Backends whose /health only answers GET
+                response = self.session.get(self._health_url, timeout=self.HEALTH_TIMEOUT)
             if response.status_code == 200:
                 logger.info("✅ Backend health check passed")
                 return True
-            try:
-                root_response = requests.get(self.base_url, headers=headers, timeout=10)
-                if root_response.status_code == 200:
-                    logger.info("✅ Backend root endpoint accessible")
-                    return True
-            except:
-                pass
             logger.warning(f"⚠️ Backend health check failed with status code: {response.status_code}")
         except requests.exceptions.RequestException as e:
             logger.error(f"❌ Backend health check error: {str(e)}")
         return False
 
-    def _send_request(self, endpoint, payload, max_retries=3, retry_delay=2):
-        self._ensure_base_url()
-        if not self.base_url:
+    def _send_request(self, full_url, payload, max_retries=3, retry_delay=2):
+        if not full_url:
             logger.error("❌ Backend URL not configured")
             return None, "Backend URL not configured"
 
-        full_url = f"{self.base_url}{endpoint}"
+        # Serialize once; the preview is cut from the same bytes that go on the wire
+        body = orjson.dumps(payload)
+        if logger.isEnabledFor(logging.DEBUG):
+            payload_preview = body[:200].decode("utf-8", "replace") + ("..." if len(body) > 200 else "")
+            logger.debug("➡️ Sending request to: %s", full_url)
+            logger.debug("📝 Payload preview: %s", payload_preview)
 
-        # Safer logging: only preview part of payload
-        try:
-            payload_preview = json.dumps(payload)[:200] + (
-                "..." if len(json.dumps(payload)) > 200 else ""
-            )
-        except Exception:
-            payload_preview = str(payload)[:200] + "..."
-        logger.debug(f"➡️ Sending request to: {full_url}")
-        logger.debug(f"📝 Payload preview: {payload_preview}")
+        if not self._breaker.allow():
+            logger.warning("⚡ Backend circuit open; failing fast")
+            return None, "Backend service is temporarily unavailable. Please try again later."
 
+        deadline = time.monotonic() + self.total_budget_s
+        timed_out = False
         for attempt in range(max_retries):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"⏱️ Backend time budget of {self.total_budget_s}s exhausted")
+                timed_out = True
+                break
             try:
-                response = requests.post(
+                response = self.session.post(
                     full_url,
-                    json=payload,
-                    headers={
-                        "Content-Type": "application/json",
-                        "ngrok-skip-browser-warning": "1",
-                    },
-                    timeout=60,
+                    data=body,
+                    headers=self.JSON_HEADERS,
+                    timeout=min(self.request_timeout, remaining),
                 )
-                logger.info(f"⬅️ Response status: {response.status_code}")
+                logger.info("⬅️ Response status: %s", response.status_code)
+                if response.status_code >= 500:
+                    self._breaker.record_failure()
+                    self._invalidate_health()
+                else:
+                    self._breaker.record_success()
                 if response.status_code == 200:
-                    return response.json(), None
-                elif response.status_code == 429:
-                    logger.warning(f"⏳ Rate limit exceeded (attempt {attempt+1}/{max_retries})")
-                    time.sleep(retry_delay * (attempt + 1))
+                    return orjson.loads(response.content), None
+                elif response.status_code in RETRY_STATUSES and attempt + 1 < max_retries:
+                    logger.warning(
+                        f"⏳ Backend returned {response.status_code} (attempt {attempt+1}/{max_retries})"
+                    )
+                    delay = self._backoff(attempt, retry_delay, _retry_after_seconds(response))
+                    self._sleep_until(deadline, delay)
                 else:
-                    try:
-                        error_msg = response.json().get(
-                            "error", f"HTTP error {response.status_code}"
-                        )
-                    except:
-                        error_msg = f"HTTP error {response.status_code}"
+                    error_msg = f"HTTP error {response.status_code}"
+                    if response.content:
+                        try:
+                            body_json = orjson.loads(response.content)
+                        except orjson.JSONDecodeError:
+                            body_json = None
+                        if isinstance(body_json, dict):
+                            error_msg = body_json.get("error", error_msg)
                     logger.error(f"❌ Request failed: {error_msg}")
                     return None, error_msg
             except requests.exceptions.Timeout:
                 logger.warning(f"⏱️ Request timed out (attempt {attempt+1}/{max_retries})")
-                time.sleep(retry_delay)
-            except Exception as e:
+                timed_out = True
+                self._invalidate_health()
+                if attempt + 1 < max_retries:
+                    self._sleep_until(deadline, self._backoff(attempt, retry_delay))
+            except requests.exceptions.ConnectionError as e:
+                logger.error(f"❌ Backend unreachable: {str(e)}")
+                self._breaker.record_failure()
+                self._invalidate_health()
+                return None, BACKEND_UNREACHABLE
+            except (requests.exceptions.RequestException, ValueError) as e:
                 logger.error(f"❌ Request error: {str(e)}")
+                self._breaker.record_failure()
                 return None, str(e)
 
+        if timed_out:
+            self._breaker.record_failure()
+        if time.monotonic() >= deadline:
+            return None, "Backend request exceeded its time budget"
         return None, "Maximum retry attempts reached"
 
+    @staticmethod
+    def _backoff(attempt, retry_delay, retry_after=None):
+        """Exponential backoff with jitter so concurrent clients don't retry in lockstep;
+        a server-supplied Retry-After wins when present."""
+        if retry_after is not None:
+            return min(retry_after, MAX_BACKOFF)
+        return min(random.uniform(retry_delay, retry_delay * 2 ** attempt), MAX_BACKOFF)
+
+    @staticmethod
+    def _sleep_until(deadline, delay):
+        """Sleep for `delay`, but never past `deadline`."""
+        delay = min(delay, deadline - time.monotonic())
+        if delay > 0:
+            time.sleep(delay)
+
+    @staticmethod
+    def _request_key(*parts):
+        return hashlib.blake2b(repr(parts).encode(), digest_size=16).digest()
+
+    def _collapsed(self, key, fn):
+        """Serve `fn()` from the result cache, or share one in-flight call between identical
+        concurrent requests. Only error-free results are cached."""
+        with self._cache_lock:
+            hit = self._result_cache.get(key)
+            if hit and time.monotonic() - hit[0] < self._result_cache_ttl:
+                self._result_cache.move_to_end(key)
+                return hit[1]
+            waiter = self._inflight.get(key)
+            if waiter is None:
+                waiter = self._inflight[key] = [threading.Event(), None]
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            waiter[0].wait()
+            return waiter[1]
+
+        outcome = (None, "Request failed")
+        try:
+            outcome = fn()
+        finally:
+            with self._cache_lock:
+                if outcome[1] is None:
+                    self._result_cache[key] = (time.monotonic(), outcome)
+                    self._result_cache.move_to_end(key)
+                    while len(self._result_cache) > self._result_cache_size:
+                        self._result_cache.popitem(last=False)
+                waiter[1] = outcome
+                del self._inflight[key]
+            waiter[0].set()
+        return outcome
+
     def generate_image(
         self,
         prompt,
@@ -138,39 +411,40 @@ class BackendService:
             logger.warning("⚠️ Skipping image generation: no backend URL configured")
             return None, "Image generation is disabled because COLAB_ENDPOINT is not configured or accessible."
 
-        if not self._test_connection():
-            logger.error("❌ Backend service unavailable")
-            return None, "Backend service is currently unavailable. Please try again later."
-
-        endpoint = "/generate"
         payload = {"prompt": prompt}
-
-        if style and style != "auto":
-            payload["style"] = style
-        if negative_prompt:
-            payload["negative_prompt"] = negative_prompt
-        if guidance_scale:
-            payload["guidance_scale"] = guidance_scale
-        if num_inference_steps:
-            payload["num_inference_steps"] = num_inference_steps
+        payload.update(_payload_template(style, guidance_scale, negative_prompt, num_inference_steps))
         if seed:
             payload["seed"] = seed
 
-        # Safe logging for prompts
-        prompt_preview = (prompt[:100] + "...") if len(prompt) > 100 else prompt
-        logger.info(f"🖼️ Generating image with prompt preview: '{prompt_preview}'")
+        # Safe logging for prompts; the preview is only built when INFO is enabled
+        if logger.isEnabledFor(logging.INFO):
+            prompt_preview = (prompt[:100] + "...") if len(prompt) > 100 else prompt
+            logger.info("🖼️ Generating image with prompt preview: '%s'", prompt_preview)
 
-        result, error = self._send_request(endpoint, payload)
+        if seed:
+            # A fixed seed makes the output deterministic, so identical requests can share it
+            key = self._request_key("/generate", sorted(payload.items()))
+            result, error = self._collapsed(
+                key, lambda: self._send_request(self._generate_url, payload)
+            )
+        else:
+            result, error = self._send_request(self._generate_url, payload)
 
+        if error == BACKEND_UNREACHABLE:
+            return None, UNAVAILABLE_MESSAGE
         if error:
             if "404" in str(error):
                 logger.warning("⚠️ Backend returned 404 - likely missing route or misconfigured backend URL.")
             logger.error(f"❌ Image generation failed: {error}")
             return None, error
 
-        # Handle base64 image fallback
+        # Base64 fallback: decode once to a file rather than passing a multi-MB data: URL around
         if not result.get("image_url") and result.get("image"):
-            result["image_url"] = f"data:image/png;base64,{result['image']}"
+            try:
+                result["image_url"] = self._store_image(result.pop("image"))
+            except (binascii.Error, ValueError, OSError) as e:
+                logger.error(f"❌ Could not store generated image: {e}")
+                return None, "Could not store generated image"
 
         if not result.get("image_url"):
             logger.error("⚠️ No image data in response")
@@ -178,12 +452,39 @@ class BackendService:
 
         return result, None
 
+    def _store_image(self, image_b64):
+        """Decode a base64 PNG into the generated-images folder and return its URL.
+        Files are content-addressed, so a repeated image is written only once."""
+        if not self.image_dir:
+            raise OSError("No static folder configured for generated images")
+        img_bytes = base64.b64decode(image_b64, validate=True)
+        name = f"{hashlib.blake2b(img_bytes, digest_size=16).hexdigest()}.png"
+        path = os.path.join(self.image_dir, name)
+        if not os.path.exists(path):
+            os.makedirs(self.image_dir, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(img_bytes)
+            os.replace(tmp_path, path)
+        return f"{self.image_url_prefix}/{name}"
+
     def validate_prompt(self, prompt):
+        key = self._request_key("/validate_prompt", prompt)
+        return self._collapsed(key, lambda: self._validate_prompt_uncached(prompt))
+
+    def _validate_prompt_uncached(self, prompt):
         if self.use_local_validation:
             try:
-                result = validate_prompt_locally(prompt)
+                if self._bert_pool is not None:
+                    future = self._bert_pool.submit(_validate_in_worker, prompt)
+                    result = future.result(timeout=BERT_TIMEOUT)
+                else:
+                    result = _validate_in_worker(prompt)
                 logger.info("✅ Local prompt validation complete")
                 return result, None
+            except concurrent.futures.TimeoutError:
+                logger.error("❌ Local prompt validation timed out")
+                return None, "Prompt validation timed out. Please try again."
             except Exception as e:
                 logger.error(f"❌ Local prompt validation error: {e}")
                 return None, str(e)
@@ -194,15 +495,17 @@ class BackendService:
             logger.error("❌ Backend URL not configured")
             return None, "Backend URL not configured"
 
-        endpoint = "/validate_prompt"
         payload = {"prompt": prompt}
 
-        prompt_preview = (prompt[:80] + "...") if len(prompt) > 80 else prompt
-        logger.info(f"🧠 Validating prompt remotely: '{prompt_preview}'")
+        if logger.isEnabledFor(logging.INFO):
+            prompt_preview = (prompt[:80] + "...") if len(prompt) > 80 else prompt
+            logger.info("🧠 Validating prompt remotely: '%s'", prompt_preview)
 
         try:
-            result, error = self._send_request(endpoint, payload)
+            result, error = self._send_request(self._validate_url, payload)
 
+            if error == BACKEND_UNREACHABLE:
+                return None, UNAVAILABLE_MESSAGE
             if error:
                 if "404" in str(error):
                     logger.warning("⚠️ Backend returned 404 - likely missing route or misconfigured backend URL.")
@@ -239,17 +542,7 @@ class BackendService:
     def check_health(self):
         if not self.base_url:
             return False
-
-        try:
-            headers = {"ngrok-skip-browser-warning": "1"}
-            response = requests.get(f"{self.base_url}/health", headers=headers, timeout=5)
-
-            if response.status_code == 404:
-                response = requests.get(self.base_url, headers=headers, timeout=5)
-
-            return response.status_code == 200
-        except requests.exceptions.RequestException:
-            return False
+        return self._probe(ttl=5.0)
 
     def is_offline_mode(self):
         if has_app_context():
@@ -1,8 +1,16 @@
 import os
 import torch
-from transformers import BertTokenizer, BertForSequenceClassification, BertConfig
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
 import re
 import logging
+import math
+import ahocorasick
+import platform
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -17,16 +25,261 @@ logger.info(f"Using device: {device}")
 # Model directory (from env or default)
 # -----------------------
 MODEL_DIR = os.getenv("BERT_MODEL_DIR", "models/bert")
+PROMPT_CACHE_SIZE = int(os.getenv("BERT_PROMPT_CACHE_SIZE", 4096))
+QUANTIZE_ON_CPU = os.getenv("BERT_QUANTIZE", "True").lower() == "true"
+CPU_THREADS = int(os.getenv("BERT_NUM_THREADS", 1))
+USE_TORCHSCRIPT = os.getenv("BERT_TORCHSCRIPT", "True").lower() == "true"
+USE_CUDA_GRAPHS = os.getenv("BERT_CUDA_GRAPHS", "True").lower() == "true"
+FAST_PATH_ENABLED = os.getenv("BERT_FAST_PATH", "True").lower() == "true"
+FAST_PATH_MIN_CATEGORIES = 3
+MAX_LENGTH = int(os.getenv("BERT_MAX_LENGTH", 64))  # prompts are short; bounds O(n²) attention
+SEQ_BUCKET = 32  # CUDA graphs need fixed shapes, so sequence lengths are padded to multiples of this
+BATCH_WINDOW = float(os.getenv("BERT_BATCH_WINDOW_MS", 0)) / 1000  # only helps threads sharing one model; pool workers see one prompt at a time
+MAX_BATCH = int(os.getenv("BERT_MAX_BATCH", 16))
+USE_AUTOCAST = os.getenv("BERT_AUTOCAST", "True").lower() == "true"
+ONNX_PATH = os.getenv("BERT_ONNX_PATH")  # optimized ONNX export of MODEL_DIR, see export_onnx()
 
 # -----------------------
 # Load tokenizer & model
 # -----------------------
-config = BertConfig.from_pretrained(MODEL_DIR)
-tokenizer = BertTokenizer.from_pretrained(MODEL_DIR)
-model = BertForSequenceClassification.from_pretrained(MODEL_DIR, config=config)
+# Auto classes pick the architecture from MODEL_DIR's config, so a distilled student
+# (DistilBERT, TinyBERT, ...) fine-tuned on the same 7 labels is a drop-in replacement
+config = AutoConfig.from_pretrained(MODEL_DIR)
+tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR, use_fast=True)  # Rust tokenizer
+model = AutoModelForSequenceClassification.from_pretrained(MODEL_DIR, config=config)
 model.to(device)
 model.eval()
-logger.info(f"✅ Model loaded with {model.config.num_labels} labels (expected 7)")
+model.requires_grad_(False)  # inference only; no autograd bookkeeping on weights
+
+
+def _load_onnx_session():
+    """ONNX Runtime session for ONNX_PATH, or None to run the model in PyTorch."""
+    if not ONNX_PATH:
+        return None
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        logger.warning("BERT_ONNX_PATH is set but onnxruntime is not installed; using PyTorch")
+        return None
+    providers = [p for p in ("CUDAExecutionProvider", "CPUExecutionProvider")
+                 if p in ort.get_available_providers()]
+    session = ort.InferenceSession(ONNX_PATH, providers=providers)
+    logger.info(f"✅ Using ONNX Runtime model {ONNX_PATH} ({session.get_providers()[0]})")
+    return session
+
+onnx_session = _load_onnx_session()
+
+
+def export_onnx(path, opset_version=17):
+    """Export the FP32 classifier in MODEL_DIR to ONNX with dynamic batch and sequence axes.
+
+    Optionally fuse it for BERT afterwards, then point BERT_ONNX_PATH at the result:
+        python -m onnxruntime.transformers.optimizer --input bert.onnx --output bert_opt.onnx \
+            --model_type bert --num_heads 12 --hidden_size 768
+    """
+    fp32_model = AutoModelForSequenceClassification.from_pretrained(MODEL_DIR).eval()
+    fp32_model.config.return_dict = False
+    example = tokenizer("a modern living room", return_tensors="pt")
+    dynamic = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            fp32_model,
+            (example["input_ids"], example["attention_mask"]),
+            path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={"input_ids": dynamic, "attention_mask": dynamic, "logits": {0: "batch"}},
+            opset_version=opset_version,
+        )
+
+# On CPU, dynamic INT8 quantization of the Linear layers roughly halves latency and shrinks the
+# resident model; a small thread count avoids oversubscription (we already run one model per
+# worker process). CUDA keeps the FP32 model.
+quantized = False
+if device.type == "cpu" and QUANTIZE_ON_CPU and onnx_session is None:
+    preferred = "qnnpack" if platform.machine().lower() in ("arm64", "aarch64") else "fbgemm"
+    if preferred in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = preferred
+        torch.set_num_threads(CPU_THREADS)
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        quantized = True
+        logger.info(f"✅ Quantized BERT to INT8 ({preferred}, {CPU_THREADS} thread(s))")
+    else:
+        logger.warning(f"⚠️ Quantized engine '{preferred}' unavailable; keeping FP32 model")
+logger.info(
+    f"✅ Model loaded ({model.config.model_type}, {model.config.num_hidden_layers} layers) "
+    f"with {model.config.num_labels} labels (expected 7)"
+)
+
+
+def _autocast_dtype():
+    """Reduced precision for the forward pass: FP16 on CUDA, BF16 on CPUs with native support.
+    An INT8-quantized model already runs its matmuls in INT8 and is left alone."""
+    if not USE_AUTOCAST:
+        return None
+    if device.type == "cuda":
+        return torch.float16
+    if not quantized:
+        try:
+            if torch.ops.mkldnn._is_mkldnn_bf16_supported():
+                return torch.bfloat16
+        except (AttributeError, RuntimeError):
+            pass
+    return None
+
+AUTOCAST_DTYPE = _autocast_dtype()
+
+
+def _autocast():
+    if AUTOCAST_DTYPE is None:
+        return nullcontext()
+    return torch.autocast(device_type=device.type, dtype=AUTOCAST_DTYPE)
+
+
+def _compile_model(eager_model):
+    """Trace, freeze and optimize the model for inference, or return None if that fails.
+
+    The traced module takes (input_ids, attention_mask) and returns a tuple whose first
+    element is the logits. It is checked against eager output on a padded batch of other
+    lengths so a trace that baked in shapes is never used."""
+    torch._C._jit_set_texpr_fuser_enabled(False)  # avoids a recompile stall on the 2nd call
+    eager_model.config.return_dict = False
+    try:
+        with torch.no_grad(), _autocast():
+            example = tokenizer("a modern living room", return_tensors="pt", truncation=True, padding=True)
+            traced = torch.jit.trace(
+                eager_model,
+                (example["input_ids"].to(device), example["attention_mask"].to(device)),
+                strict=False,
+            )
+            traced = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+
+            check = tokenizer(
+                ["a rustic den", "a cozy scandinavian living room with light oak shelving and linen sofa"],
+                return_tensors="pt", truncation=True, padding=True,
+            )
+            ids, mask = check["input_ids"].to(device), check["attention_mask"].to(device)
+            atol = 1e-3 if AUTOCAST_DTYPE is None else 5e-2  # half precision is noisier
+            if not torch.allclose(traced(ids, mask)[0].float(), eager_model(ids, mask)[0].float(), atol=atol):
+                raise ValueError("traced output differs from eager output")
+        return traced
+    except Exception as e:
+        logger.warning(f"⚠️ TorchScript compilation failed, using eager model: {e}")
+        return None
+
+
+def _compile_cuda_graphs(eager_model):
+    """torch.compile in reduce-overhead mode, so each forward replays a captured CUDA graph
+    instead of launching every kernel from Python. Warmed up here for the common sequence
+    buckets; returns None if compilation fails."""
+    eager_model.config.return_dict = False
+    try:
+        compiled = torch.compile(eager_model, mode="reduce-overhead")
+        with torch.inference_mode(), _autocast():
+            for length in (SEQ_BUCKET, 2 * SEQ_BUCKET):
+                ids = torch.zeros((1, length), dtype=torch.long, device=device)
+                compiled(ids, torch.ones_like(ids))
+        return compiled
+    except Exception as e:
+        logger.warning(f"⚠️ CUDA graph compilation failed: {e}")
+        return None
+
+
+compiled_model = None
+if onnx_session is None:
+    if device.type == "cuda" and USE_CUDA_GRAPHS and hasattr(torch, "compile"):
+        compiled_model = _compile_cuda_graphs(model)
+    if compiled_model is None and USE_TORCHSCRIPT:
+        compiled_model = _compile_model(model)
+PAD_MULTIPLE = SEQ_BUCKET if compiled_model is not None and device.type == "cuda" else None
+
+
+def _model_logits(inputs):
+    """Logits for tokenized inputs, via ONNX Runtime or the compiled model when available."""
+    if onnx_session is not None:
+        feed = {
+            "input_ids": inputs["input_ids"].cpu().numpy(),
+            "attention_mask": inputs["attention_mask"].cpu().numpy(),
+        }
+        return torch.from_numpy(onnx_session.run(None, feed)[0]).to(device).float()
+    with _autocast():
+        if compiled_model is not None:
+            logits = compiled_model(inputs["input_ids"], inputs["attention_mask"])[0]
+        else:
+            logits = model(**inputs, return_dict=False)[0]
+    # Boosts and softmax stay in FP32
+    return logits.float()
+
+
+class _LogitsBatcher:
+    """Runs prompts from concurrent callers through the model as one padded batch.
+
+    A daemon thread takes the first queued prompt, waits up to `window` seconds for more
+    (at most `max_batch`), runs a single forward pass and hands each caller its own row."""
+
+    def __init__(self, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name="bert-batcher", daemon=True).start()
+
+    def logits(self, prompt):
+        item = [prompt, threading.Event(), None, None]  # prompt, done, logits, error
+        self._queue.put(item)
+        item[1].wait()
+        if item[3] is not None:
+            raise item[3]
+        return item[2]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                inputs = tokenizer(
+                    [item[0] for item in batch], return_tensors="pt", truncation=True,
+                    max_length=MAX_LENGTH, padding=True, pad_to_multiple_of=PAD_MULTIPLE,
+                )
+                inputs = {k: v.to(device) for k, v in inputs.items()}
+                with torch.inference_mode():
+                    logits = _model_logits(inputs)
+                for row, item in zip(logits, batch):
+                    item[2] = row.unsqueeze(0).clone()  # callers adjust their logits in place
+            except Exception as e:
+                for item in batch:
+                    item[3] = e
+            finally:
+                for item in batch:
+                    item[1].set()
+
+
+_batcher = _LogitsBatcher(BATCH_WINDOW, MAX_BATCH) if BATCH_WINDOW > 0 else None
+
+
+def _prompt_logits(prompt):
+    """[1, num_labels] logits for one prompt, batched with concurrent callers when enabled."""
+    if _batcher is not None:
+        return _batcher.logits(prompt)
+    # A single sequence needs no padding unless CUDA graphs want a bucketed length
+    inputs = tokenizer(
+        prompt, return_tensors="pt", truncation=True, max_length=MAX_LENGTH,
+        padding=PAD_MULTIPLE is not None, pad_to_multiple_of=PAD_MULTIPLE,
+    )
+    inputs = {k: v.to(device) for k, v in inputs.items()}
+    with torch.inference_mode():
+        return _model_logits(inputs)
 
 # -----------------------
 # Label mapping
@@ -41,6 +294,14 @@ label_map = {
     6: "traditional",
 }
 
+# Only allow these styles for UI use
+ALLOWED_STYLES = ["modern", "scandinavian", "industrial", "coastal", "mid-century", "rustic", "traditional"]
+ALLOWED_INDICES = [idx for idx, label in label_map.items() if label in ALLOWED_STYLES]
+ALLOWED_INDICES_T = torch.tensor(ALLOWED_INDICES, device=device, dtype=torch.long)
+
+# How each label reads when a user names it in a prompt, e.g. "mid-century modern"
+STYLE_LABEL_PHRASES = {i: label.replace("_", " ") for i, label in label_map.items()}
+
 STYLE_HINTS = {
         'Modern': {
         'colors': ['graphite gray', 'beige', 'chrome', 'matte black', 'cool taupe','matte silver', 'deep charcoal', 'slate blue', 'steel blue', 'cool gray'],
@@ -101,37 +362,213 @@ STYLE_HINTS = {
 }
 
 def extract_keywords_from_styles(style_hints):
-    extracted = {}
-    for style, categories in style_hints.items():
-        keywords = []
-        for values in categories.values():
-            keywords.extend(values)
-        extracted[style.lower()] = list(set(keywords))  # Remove duplicates
-    return extracted
+    # Lowercased and deduplicated once here, so lookups never re-lower per request
+    return {
+        style.lower(): frozenset(v.lower() for values in categories.values() for v in values)
+        for style, categories in style_hints.items()
+    }
 
 STYLE_KEYWORDS = extract_keywords_from_styles(STYLE_HINTS)
 
 
+def build_keyword_automaton(style_hints):
+    """Aho-Corasick automaton mapping each lowercased keyword to its (style, category, keyword) hits."""
+    entries = {}
+    for style, categories in style_hints.items():
+        for category, keywords in categories.items():
+            for keyword in keywords:
+                entries.setdefault(keyword.lower(), []).append((style.lower(), category, keyword))
+    automaton = ahocorasick.Automaton()
+    for key, hits in entries.items():
+        automaton.add_word(key, tuple(hits))
+    automaton.make_automaton()
+    return automaton
+
+KEYWORD_AUTOMATON = build_keyword_automaton(STYLE_HINTS)
+
+
+def match_style_keywords(lower_prompt):
+    """Every style keyword found in one pass over the prompt, as {style: {category: {keyword, ...}}}."""
+    matches = {}
+    for _, hits in KEYWORD_AUTOMATON.iter(lower_prompt):
+        for style, category, keyword in hits:
+            matches.setdefault(style, {}).setdefault(category, set()).add(keyword)
+    return matches
+
+
+LIVING_ROOM_RE = re.compile(
+    r'\b(?:living\s*room|sitting\s*room|lounge|family\s*room|living\s*area|sitting\s*area'
+    r'|common\s*area|front\s*room|parlor|den|great\s*room|reception\s*room)\b',
+    re.IGNORECASE,
+)
+
 def is_living_room_related(prompt):
     """Check if the prompt contains living room related terms."""
-    living_room_terms = [
-        r'\bliving\s*room\b', r'\bsitting\s*room\b', r'\blounge\b', r'\bfamily\s*room\b',
-        r'\bliving\s*area\b', r'\bsitting\s*area\b', r'\bcommon\s*area\b', r'\bfront\s*room\b',
-        r'\bparlor\b', r'\bden\b', r'\bgreat\s*room\b', r'\breception\s*room\b'
-    ]
-    prompt_lower = prompt.lower()
-    return any(re.search(term, prompt_lower) for term in living_room_terms)
+    return LIVING_ROOM_RE.search(prompt) is not None
 
 def sanitize_prompt(prompt):
     """Basic sanitization of prompt input."""
     if not prompt or not isinstance(prompt, str):
         return ""
-    # Remove leading/trailing whitespace and multiple spaces
-    cleaned = ' '.join(prompt.strip().split())
+    # Remove leading/trailing whitespace and multiple spaces; split() already drops both ends
+    cleaned = ' '.join(prompt.split())
     return cleaned
 
+def _explain_style(style_name, keyword_matches):
+    """One reason per hint category the prompt matched for `style_name`."""
+    explanation = []
+    style_title_case = style_name.title()  # convert 'modern' → 'Modern'
+
+    # Only try to explain if it's a recognized style; reuses the keyword matches from the scan
+    matched_categories = []
+    if style_title_case in STYLE_HINTS:
+        style_matches = keyword_matches.get(style_title_case.lower(), {})
+        for category, keywords in STYLE_HINTS[style_title_case].items():
+            found = style_matches.get(category)
+            if found:
+                # First keyword in hint order, one per category
+                keyword = next(k for k in keywords if k in found)
+                matched_categories.append(category)
+                explanation.append(f"mentions of {category} like '{keyword}'")
+        if not matched_categories:
+            explanation.append("based on overall language and style structure")
+    else:
+        explanation.append("style not found in hint database")
+    logger.info(f"💡 Matched categories for explanation: {matched_categories}")
+    return explanation
+
+
+def _explicit_style_result(lower_prompt, keyword_matches):
+    """Result for a prompt that names an allowed style and matches enough of its hint
+    categories that the keyword boosts would decide it anyway; None otherwise."""
+    best_idx, best_hits = None, 0
+    for i in ALLOWED_INDICES:
+        hits = len(keyword_matches.get(STYLE_LABEL_PHRASES[i], ()))
+        if hits > best_hits and STYLE_LABEL_PHRASES[i] in lower_prompt:
+            best_idx, best_hits = i, hits
+    if best_hits < FAST_PATH_MIN_CATEGORIES:
+        return None
+
+    style_name = label_map[best_idx]
+    confidence = round(min(0.99, 0.8 + 0.05 * best_hits), 3)
+    logger.info(f"⚡ Explicit '{style_name}' with {best_hits} matched categories; skipping the model")
+    return {
+        "valid": True,
+        "prompt_score": confidence,
+        "detected_style": style_name,
+        "style_confidence": confidence,
+        "secondary_style": "",
+        "secondary_confidence": 0.0,
+        "intent": "generate",
+        "style_reasons": _explain_style(style_name, keyword_matches),
+        "message": "Prompt validation completed"
+    }
+
+
+@lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def _classify_prompt(prompt, lower_prompt):
+    """Classify a sanitized living-room prompt; memoized, exceptions are not cached.
+
+    `lower_prompt` is the caller's lowercased copy, shared by the keyword scan, the
+    explicit-mention checks and the explanation; the model still sees `prompt` as typed.
+    """
+    keyword_matches = match_style_keywords(lower_prompt)
+    if FAST_PATH_ENABLED:
+        result = _explicit_style_result(lower_prompt, keyword_matches)
+        if result is not None:
+            return result
+
+    with torch.inference_mode():
+        logits = _prompt_logits(prompt)
+        # Boost logits based on keyword matches
+        KEYWORD_BOOST = 0.5
+        LABEL_EXPLICIT_BOOST = 2.0
+        # Adjustments are summed in Python and applied to the logits in one tensor op
+        boosts = [0.0] * len(label_map)
+        for i, label in label_map.items():
+            style_matches = keyword_matches.get(label.lower())
+            if style_matches:
+                match_keywords = sorted(set().union(*style_matches.values()))
+                boosts[i] += KEYWORD_BOOST
+                logger.info(f"📌 Boosted '{label}' for keyword match: {match_keywords}")
+
+            if STYLE_LABEL_PHRASES[i] in lower_prompt:
+                boosts[i] += LABEL_EXPLICIT_BOOST
+                logger.info(f"📣 Explicit style mention of '{label}' — stronger boost applied.")
+
+        # Penalize rustic if it's not explicitly mentioned or matched by keywords
+        rustic_idx = next((i for i, l in label_map.items() if l.lower() == "rustic"), None)
+        if rustic_idx is not None:
+            if "rustic" not in lower_prompt and "rustic" not in keyword_matches:
+                boosts[rustic_idx] -= 1.0  # adjust as needed
+                logger.info("⛔ Penalized 'rustic' due to lack of matching indicators.")
+
+        logits[0].add_(torch.tensor(boosts, device=logits.device, dtype=logits.dtype))
+
+        if logits is None or logits.shape[0] == 0:
+            logger.error("Model returned empty logits.")
+            raise ValueError("Invalid model output")
+
+        # Probabilities stay normalized over all labels, but only the ones read below
+        # are exponentiated: p_i = exp(logit_i - logsumexp(logits))
+        row = logits[0]
+        log_norm = torch.logsumexp(row, dim=0)
+
+        # 🔍 Optional log
+        original_top_logit, original_top_idx = (t.item() for t in row.max(dim=0))
+        original_top_label = label_map.get(original_top_idx, "unknown")
+        if original_top_label not in ALLOWED_STYLES:
+            original_top_conf = math.exp(original_top_logit - log_norm.item())
+            logger.info(f"🔍 Top model prediction '{original_top_label}' ({original_top_conf:.3f}) excluded from allowed UI styles")
+
+        # Top two among the allowed styles
+        top_vals, top_pos = torch.topk(row.index_select(0, ALLOWED_INDICES_T), 2)
+        (top1_conf, top2_conf), (top1_pos, top2_pos) = (top_vals - log_norm).exp().tolist(), top_pos.tolist()
+        top1_idx, top2_idx = ALLOWED_INDICES[top1_pos], ALLOWED_INDICES[top2_pos]
+
+        # Override top style with explicitly mentioned style if confidence is close
+        explicit_mentioned_idx = next(
+            (i for i, phrase in STYLE_LABEL_PHRASES.items() if phrase in lower_prompt), None
+        )
+
+        if explicit_mentioned_idx is not None and explicit_mentioned_idx != top1_idx:
+            explicit_conf = (row[explicit_mentioned_idx] - log_norm).exp().item()
+            gap = top1_conf - explicit_conf
+            if gap < 0.1:  # adjustable threshold
+                logger.warning(f"⚠️ Overriding top style to explicitly mentioned '{label_map[explicit_mentioned_idx]}' due to close confidence margin.")
+                top1_idx = explicit_mentioned_idx
+                top1_conf = explicit_conf
+
+        # The full softmax and its host copy are only worth paying for when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🧠 Full style prediction breakdown:")
+            for i, prob in enumerate(torch.softmax(row, dim=0).tolist()):
+                logger.debug(f" - {label_map[i]}: {prob:.4f}")
+
+    style_name = label_map.get(top1_idx, "unknown")
+    second_style = label_map.get(top2_idx, "unknown")
+    logger.info(f"Predicted style: {style_name} ({top1_conf:.3f}), 2nd: {second_style} ({top2_conf:.3f})")
+    if "modern" in lower_prompt and style_name != "modern":
+        logger.warning(f"⚠️ User mentioned 'modern' but predicted style is '{style_name}'")
+
+    explanation = _explain_style(style_name, keyword_matches)
+
+    return {
+        "valid": True,
+        "prompt_score": round(top1_conf, 3),
+        "detected_style": style_name,
+        "style_confidence": round(top1_conf, 3),
+        "secondary_style": second_style,
+        "secondary_confidence": round(top2_conf, 3),
+        "intent": "generate",
+        "style_reasons": explanation,
+        "message": "Prompt validation completed"
+    }
+
+
 def validate_prompt_locally(prompt):
     prompt = sanitize_prompt(prompt)
+    lower_prompt = prompt.lower()
     logger.info(f"Validating prompt: '{prompt}'")
 
     if not prompt:
@@ -145,7 +582,7 @@ def validate_prompt_locally(prompt):
             "message": "Prompt is empty."
         }
 
-    if not is_living_room_related(prompt):
+    if not is_living_room_related(lower_prompt):
         logger.warning(f"Prompt rejected for not related to living room: '{prompt}'")
         return {
             "valid": False,
@@ -158,116 +595,9 @@ def validate_prompt_locally(prompt):
         }
 
     try:
-        inputs = tokenizer(prompt, return_tensors="pt", truncation=True, padding=True)
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
-            # Boost logits based on keyword matches
-            KEYWORD_BOOST = 0.5
-            LABEL_EXPLICIT_BOOST = 2.0
-            lower_prompt = prompt.lower()
-            for i, label in label_map.items():
-                style_lower = label.lower()
-                keywords = STYLE_KEYWORDS.get(style_lower, [])
-                
-                match_keywords = [k for k in keywords if k.lower() in lower_prompt]
-                if match_keywords:
-                    logits[0][i] += KEYWORD_BOOST
-                    logger.info(f"📌 Boosted '{label}' for keyword match: {match_keywords}")
-                
-                if label.replace("_", " ") in lower_prompt:
-                    logits[0][i] += LABEL_EXPLICIT_BOOST
-                    logger.info(f"📣 Explicit style mention of '{label}' — stronger boost applied.")
-
-            # Penalize rustic if it's not explicitly mentioned or matched by keywords
-            rustic_idx = next((i for i, l in label_map.items() if l.lower() == "rustic"), None)
-            if rustic_idx is not None:
-                rustic_keywords = STYLE_KEYWORDS["rustic"]
-                if "rustic" not in lower_prompt and not any(k in lower_prompt for k in rustic_keywords):
-                    logits[0][rustic_idx] -= 1.0  # adjust as needed
-                    logger.info("⛔ Penalized 'rustic' due to lack of matching indicators.")
-
-            if logits is None or logits.shape[0] == 0:
-                logger.error("Model returned empty logits.")
-                raise ValueError("Invalid model output")
-
-            # Only allow these styles for UI use
-            ALLOWED_STYLES = ["modern", "scandinavian", "industrial", "coastal", "mid-century", "rustic", "traditional"]
-
-            # Softmax over all logits first
-            probs = torch.nn.functional.softmax(logits, dim=1)[0]
-
-            # 🔍 Optional log
-            full_sorted = list(enumerate(probs.tolist()))
-            full_sorted.sort(key=lambda x: x[1], reverse=True)
-            original_top_idx, original_top_conf = full_sorted[0]
-            original_top_label = label_map.get(original_top_idx, "unknown")
-            if original_top_label not in ALLOWED_STYLES:
-                logger.info(f"🔍 Top model prediction '{original_top_label}' ({original_top_conf:.3f}) excluded from allowed UI styles")
-
-            # Extract only allowed logits
-            allowed_indices = [idx for idx, label in label_map.items() if label in ALLOWED_STYLES]
-            filtered = [(idx, probs[idx].item()) for idx in allowed_indices]
-            filtered.sort(key=lambda x: x[1], reverse=True)
-            top1_idx, top1_conf = filtered[0]
-            top2_idx, top2_conf = filtered[1]
-
-            # Override top style with explicitly mentioned style if confidence is close
-            explicit_mentioned_idx = None
-            for i, label in label_map.items():
-                if label.replace("_", " ") in lower_prompt:
-                    explicit_mentioned_idx = i
-                    break
-
-            if explicit_mentioned_idx is not None and explicit_mentioned_idx != top1_idx:
-                gap = probs[top1_idx].item() - probs[explicit_mentioned_idx].item()
-                if gap < 0.1:  # adjustable threshold
-                    logger.warning(f"⚠️ Overriding top style to explicitly mentioned '{label_map[explicit_mentioned_idx]}' due to close confidence margin.")
-                    top1_idx = explicit_mentioned_idx
-                    top1_conf = probs[explicit_mentioned_idx].item()
-
-            logger.info("🧠 Full style prediction breakdown:")
-            for i, prob in enumerate(probs):
-                logger.info(f" - {label_map[i]}: {prob:.4f}")
-
-        style_name = label_map.get(top1_idx, "unknown")
-        second_style = label_map.get(top2_idx, "unknown")
-        logger.info(f"Predicted style: {style_name} ({top1_conf:.3f}), 2nd: {second_style} ({top2_conf:.3f})")
-        if "modern" in lower_prompt and style_name != "modern":
-            logger.warning(f"⚠️ User mentioned 'modern' but predicted style is '{style_name}'")
-
-        explanation = []
-        lower_prompt = prompt.lower()
-        style_title_case = style_name.title()  # convert 'modern' → 'Modern'
-
-        # Only try to explain if it's a recognized style
-        if style_title_case in STYLE_HINTS:
-            matched_categories = []
-            for category, keywords in STYLE_HINTS[style_title_case].items():
-                for keyword in keywords:
-                    if keyword.lower() in lower_prompt:
-                        matched_categories.append(category)
-                        explanation.append(f"mentions of {category} like '{keyword}'")
-                        break  # avoid listing the same category multiple times
-            if not matched_categories:
-                explanation.append("based on overall language and style structure")
-        else:
-            explanation.append("style not found in hint database")
-        logger.info(f"💡 Matched categories for explanation: {matched_categories}")
-
-        return {
-            "valid": True,
-            "prompt_score": round(top1_conf, 3),
-            "detected_style": style_name,
-            "style_confidence": round(top1_conf, 3),
-            "secondary_style": second_style,
-            "secondary_confidence": round(top2_conf, 3),
-            "intent": "generate",
-            "style_reasons": explanation,
-            "message": "Prompt validation completed"
-        }
+        result = _classify_prompt(prompt, lower_prompt)
+        # Callers get their own copy; the cached dict must not be mutated
+        return dict(result, style_reasons=list(result["style_reasons"]))
 
     except Exception as e:
         logger.exception("Error during prompt validation")
@@ -281,6 +611,38 @@ def validate_prompt_locally(prompt):
             "message": f"Validation error: {str(e)}"
         }
 
+@lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def _classify_prompt_simple(prompt):
+    """Model-only classification of a sanitized living-room prompt; memoized like _classify_prompt."""
+    with torch.inference_mode():
+        logits = _prompt_logits(prompt)
+
+        if logits is None or logits.shape[0] == 0:
+            logger.error("Model returned empty logits.")
+            raise ValueError("Invalid model output")
+
+        # Only the winner's probability is needed: exp(max - logsumexp)
+        row = logits[0]
+        top1_logit, top1_idx = (t.item() for t in row.max(dim=0))
+        top1_conf = math.exp(top1_logit - torch.logsumexp(row, dim=0).item())
+        style_name = label_map.get(top1_idx, "unknown")
+        is_valid = top1_conf >= 0.5
+
+    return {
+        "valid": is_valid,
+        "prompt_score": round(top1_conf, 3),
+        "detected_style": style_name if is_valid else "unknown",
+        "prompt": prompt,
+        "message": "Prompt validation completed" if is_valid else "Prompt rejected by confidence threshold"
+    }
+
+
+def clear_prompt_caches():
+    """Drop memoized classifications, e.g. after swapping the model."""
+    _classify_prompt.cache_clear()
+    _classify_prompt_simple.cache_clear()
+
+
 def validate_prompt_simple(prompt):
     prompt = sanitize_prompt(prompt)
     logger.info(f"Simple validation of prompt: '{prompt}'")
@@ -305,31 +667,8 @@ def validate_prompt_simple(prompt):
         }
 
     try:
-        inputs = tokenizer(prompt, return_tensors="pt", truncation=True, padding=True)
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
-
-            if logits is None or logits.shape[0] == 0:
-                logger.error("Model returned empty logits.")
-                raise ValueError("Invalid model output")
-
-            probs = torch.nn.functional.softmax(logits, dim=1)
-            sorted_probs = list(enumerate(probs[0].tolist()))
-            sorted_probs.sort(key=lambda x: x[1], reverse=True)
-            top1_idx, top1_conf = sorted_probs[0]
-            style_name = label_map.get(top1_idx, "unknown")
-            is_valid = top1_conf >= 0.5
-
-        return {
-            "valid": is_valid,
-            "prompt_score": round(top1_conf, 3),
-            "detected_style": style_name if is_valid else "unknown",
-            "prompt": prompt,
-            "message": "Prompt validation completed" if is_valid else "Prompt rejected by confidence threshold"
-        }
+        # Flat dict of immutables, so a shallow copy keeps the cached one intact
+        return dict(_classify_prompt_simple(prompt))
 
     except Exception as e:
         logger.exception("Error during simple prompt validation")
@@ -229,7 +229,7 @@ async function updateChatList() {
           chatItem.innerHTML = `
             <div class="chat-item-content flex items-center gap-2 flex-1 overflow-hidden">
               <i class="fas fa-comment-alt text-gray-600"></i>
-              <span class="truncate">${session.name}</span>
+              <span class="truncate">${escapeHTML(session.name || '')}</span>
             </div>
             <div class="chat-item-actions flex">
               <button class="rename-chat-btn text-gray-500 hover:text-blue-500 px-1" title="Rename">
@@ -733,7 +733,7 @@ function showBackendWarning(message) {
         warningBanner.innerHTML = `
             <div style="display: flex; justify-content: space-between; align-items: center;">
                 <span style="margin-right: 10px;">⚠️</span>
-                <span style="flex-grow: 1;">${message}</span>
+                <span style="flex-grow: 1;">${escapeHTML(message)}</span>
                 <button onclick="this.parentElement.parentElement.style.display='none';" style="background: none; border: none; cursor: pointer; font-weight: bold;">✕</button>
             </div>
         `;
@@ -1050,6 +1050,8 @@ function appendMessage(sender, text, imageUrl = null, styleInfo = null, ratingDa
   // Add image if present
   if (imageUrl) {
     console.log('Submitting rating for image:', shortUrl(imageUrl));
+    // Stored unescaped server-side, so escape before it lands in markup
+    const safeImageUrl = escapeHTML(imageUrl);
 
     // Get existing ratings or default 0
     const relevanceRating = ratingData?.prompt_relevance || 0;
@@ -1061,14 +1063,14 @@ function appendMessage(sender, text, imageUrl = null, styleInfo = null, ratingDa
 
     content += `
       <div class="mt-2 image-container">
-        <img src="${imageUrl}" alt="Generated design" class="rounded-lg max-w-full h-auto generated-image" />
+        <img src="${safeImageUrl}" alt="Generated design" class="rounded-lg max-w-full h-auto generated-image" />
         <div class="image-actions mt-2 flex gap-2">
-          <a href="${imageUrl}" download="generated_image.png"
+          <a href="${safeImageUrl}" download="generated_image.png"
              class="download-button bg-blue-500 text-white px-3 py-1 rounded text-sm hover:bg-blue-600" data-format="png">
             Download
           </a>
           <button class="favorite-button bg-yellow-500 text-white px-3 py-1 rounded text-sm hover:bg-yellow-600"
-                  data-image="${imageUrl}" data-prompt="${escapeHTML(text)}">
+                  data-image="${safeImageUrl}" data-prompt="${escapeHTML(text)}">
             Add to Favorites
           </button>
         </div>
@@ -1086,7 +1088,7 @@ function appendMessage(sender, text, imageUrl = null, styleInfo = null, ratingDa
         </div>
         <button
           class="submit-rating bg-purple-500 hover:bg-purple-600 text-white py-1.5 px-4 rounded text-sm font-semibold transition"
-          data-image="${imageUrl}"
+          data-image="${safeImageUrl}"
           ${isSubmitted ? 'disabled style="cursor:not-allowed; opacity:0.7;"' : ''}
         >
           ${isSubmitted ? 'Rating Submitted' : 'Submit Rating'}
@@ -1153,7 +1155,7 @@ function showStyleOverrideModal(imageUrl, originalStyle) {
       <div class="bg-white p-4 rounded-lg max-w-lg w-full mx-4">
         <h3 class="text-lg font-bold mb-2">Suggest Different Style</h3>
         <div class="mb-3">
-          <p class="text-sm">Original detected style: <strong>${originalStyle}</strong></p>
+          <p class="text-sm">Original detected style: <strong>${escapeHTML(originalStyle)}</strong></p>
           <p class="text-sm mt-2">If you think this image represents a different style, please select it below:</p>
           <select id="corrected-style" class="mt-1 block w-full pl-3 pr-10 py-2 text-base border-gray-300 rounded-md focus:outline-none focus:ring-indigo-500 focus:border-indigo-500 sm:text-sm">
             ${styleOptions}
@@ -1194,7 +1196,7 @@ function showStyleOverrideModal(imageUrl, originalStyle) {
   
         if (data.success) {
           showSuccess('Thank you for your feedback!');
-          const botMessage = document.querySelector(`.bot-message img[src="${imageUrl}"]`)?.closest('.bot-message');
+          const botMessage = document.querySelector(`.bot-message img[src="${CSS.escape(imageUrl)}"]`)?.closest('.bot-message');
           if (botMessage) {
             const styleReason = botMessage.querySelector('.style-reason');
             if (styleReason) {
@@ -1239,18 +1241,18 @@ export async function loadFavorites() {
       const card = document.createElement('div');
       card.className = 'bg-white rounded-lg shadow-md overflow-hidden';
       card.innerHTML = `
-        <img src="${favorite.image_url}" alt="Favorite design" loading="lazy" class="w-full h-48 object-cover" />
+        <img src="${escapeHTML(favorite.image_url)}" alt="Favorite design" loading="lazy" class="w-full h-48 object-cover" />
         <div class="p-3">
-          <p class="text-sm text-gray-600 line-clamp-2">${favorite.prompt || 'No description'}</p>
+          <p class="text-sm text-gray-600 line-clamp-2">${favorite.prompt ? escapeHTML(favorite.prompt) : 'No description'}</p>
           <div class="flex justify-between mt-2">
             <span class="text-xs text-gray-500">${new Date(favorite.timestamp).toLocaleDateString()}</span>
             <div class="flex gap-2">
               <button class="download-button bg-blue-500 text-white px-2 py-1 rounded text-xs hover:bg-blue-600"
-                      data-image-url="${favorite.image_url}">
+                      data-image-url="${escapeHTML(favorite.image_url)}">
                 <i class="fas fa-download mr-1"></i> Download
               </button>
               <button class="favorite-button bg-green-500 text-white px-2 py-1 rounded text-xs hover:bg-green-600"
-                      data-image="${favorite.image_url}" data-prompt="${favorite.prompt || ''}" data-favorite-id="${favorite.id}">
+                      data-image="${escapeHTML(favorite.image_url)}" data-prompt="${escapeHTML(favorite.prompt || '')}" data-favorite-id="${favorite.id}">
                 <i class="fas fa-check"></i> Favorited
               </button>
               <button class="remove-favorite text-red-500 text-sm" data-id="${favorite.id}">
@@ -1317,7 +1319,7 @@ async function loadRatings() {
         const ratingCard = document.createElement('div');
         ratingCard.className = 'bg-white rounded-lg shadow-md overflow-hidden';
         ratingCard.innerHTML = `
-          <img src="${rating.image_url}" alt="Rated design" class="w-full h-48 object-cover" />
+          <img src="${escapeHTML(rating.image_url)}" alt="Rated design" class="w-full h-48 object-cover" />
           <div class="p-3">
             <div class="flex items-center mb-1">
               <span class="text-xs mr-1">Relevance:</span>
@@ -6,7 +6,9 @@ from flask_login import login_required, current_user
 from datetime import datetime
 from markupsafe import escape
 
-from .models import ChatSession, ChatMessage
+from sqlalchemy.orm import selectinload
+
+from .models import ChatSession
 from . import db
 
 views = Blueprint("views", __name__)
@@ -29,34 +31,28 @@ def home():
     session_id = request.args.get("session_id")
     scroll_to_id = request.args.get("scroll_to")
 
-    # Step 1: Pick current session
+    # Step 1: Pick current session; its messages come along in one extra SELECT ... IN
+    owned_sessions = ChatSession.query.options(selectinload(ChatSession.messages)).filter_by(
+        user_id=current_user.id
+    )
+    chat_session = None
     if session_id:
-        chat_session = ChatSession.query.filter_by(uuid=session_id, user_id=current_user.id).first()
+        chat_session = owned_sessions.filter_by(uuid=session_id).first()
         if chat_session:
             session["current_session_id"] = session_id
     elif "current_session_id" not in session:
-        most_recent = (
-            ChatSession.query.filter_by(user_id=current_user.id)
-            .order_by(ChatSession.created_at.desc())
-            .first()
-        )
-        if most_recent:
-            session["current_session_id"] = most_recent.uuid
+        chat_session = owned_sessions.order_by(ChatSession.created_at.desc()).first()
+        if chat_session:
+            session["current_session_id"] = chat_session.uuid
 
     current_session_id = session.get("current_session_id")
-    chat_session = (
-        ChatSession.query.filter_by(uuid=current_session_id, user_id=current_user.id).first()
-        if current_session_id else None
-    )
+    if chat_session is None and current_session_id:
+        chat_session = owned_sessions.filter_by(uuid=current_session_id).first()
 
-    # Step 2: Fetch messages
+    # Step 2: Messages (ordered by timestamp on the relationship)
     messages, first_time = [], False
     if chat_session:
-        messages = (
-            ChatMessage.query.filter_by(session_id=chat_session.uuid)
-            .order_by(ChatMessage.timestamp.asc())
-            .all()
-        )
+        messages = chat_session.messages
         first_time = not any(m.is_user for m in messages)  # no user msg yet
 
     return render_template(
@@ -114,7 +110,7 @@ def connect_model():
         from .services.backend_service import BackendService
 
         backend_service = BackendService()
-        backend_service.base_url = endpoint
+        backend_service._set_base_url(endpoint)
 
         if backend_service._test_connection():
             return jsonify({"success": True, "message": "Model connected successfully"})
@@ -1,55 +1,97 @@
 import os
+import string
 import sys
+from functools import lru_cache, partial
 from getpass import getpass
-from werkzeug.security import generate_password_hash
-from dotenv import load_dotenv
-
-# Load environment variables from .env file if present
-load_dotenv()
 
 # Add the current directory to the path so we can import the app
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 
-# Import the app and db
-from app import create_app, db
-from app.models import User
+# The app, ORM and hashing imports live in the functions that need them, so --help and
+# argument errors exit without loading Flask and SQLAlchemy
 
 
 # ---------------------------
 # Password validation helper
 # ---------------------------
+_LOWER, _UPPER, _DIGIT, _SPECIAL = 1, 2, 4, 8
+_ALL_CLASSES = _LOWER | _UPPER | _DIGIT | _SPECIAL
+_SPECIALS = frozenset("!@#$%^&*()-_=+[]{};:,<.>/?\\|")
+_ASCII_CLASSES = (
+    (frozenset(string.ascii_lowercase), _LOWER),
+    (frozenset(string.ascii_uppercase), _UPPER),
+    (frozenset(string.digits), _DIGIT),
+    (_SPECIALS, _SPECIAL),
+)
+_ASCII = frozenset(map(chr, range(128)))
+
+
 def validate_password_strength(password: str) -> (bool, str):
     """Check password strength rules."""
     if len(password) < 12:
         return False, "Password must be at least 12 characters."
-    if not any(c.islower() for c in password):
+
+    # Set intersections run in C over the distinct characters
+    chars = frozenset(password)
+    seen = 0
+    for members, bit in _ASCII_CLASSES:
+        if not chars.isdisjoint(members):
+            seen |= bit
+
+    # Non-ASCII letters and digits count too, as str.islower() etc. would have it
+    if seen != _ALL_CLASSES:
+        for c in chars - _ASCII:
+            if c.islower():
+                seen |= _LOWER
+            elif c.isupper():
+                seen |= _UPPER
+            elif c.isdigit():
+                seen |= _DIGIT
+
+    if seen == _ALL_CLASSES:
+        return True, ""
+    if not seen & _LOWER:
         return False, "Password must include a lowercase letter."
-    if not any(c.isupper() for c in password):
+    if not seen & _UPPER:
         return False, "Password must include an uppercase letter."
-    if not any(c.isdigit() for c in password):
+    if not seen & _DIGIT:
         return False, "Password must include a digit."
-    if not any(c in "!@#$%^&*()-_=+[]{};:,<.>/?\\|" for c in password):
-        return False, "Password must include a special character."
-    return True, ""
+    return False, "Password must include a special character."
 
 
 # ---------------------------
 # Create or update admin user
 # ---------------------------
+@lru_cache(maxsize=1)
+def _get_app():
+    """One app per process, shared by repeated admin creations in scripts and tests."""
+    from app import create_app
+    return create_app()
+
+
 def create_admin_user(username, email, password, update_if_exists=False):
     """Create a new admin user or update an existing user to have admin privileges."""
-    app = create_app()
+    from sqlalchemy import or_, select, update
+    from app import db
+    from app.auth import hash_password
+    from app.models import User
+
+    app = _get_app()
 
     with app.app_context():
-        existing_user = User.query.filter(
-            (User.username == username) | (User.email == email)
+        # Only the columns the branches below need; username and email are unique-indexed
+        existing_user = db.session.execute(
+            select(User.id, User.username)
+            .where(or_(User.username == username, User.email == email))
+            .limit(1)
         ).first()
 
         if existing_user:
             if update_if_exists:
-                existing_user.is_admin = True
+                values = {"is_admin": True}
                 if password:  # update password if provided
-                    existing_user.password = generate_password_hash(password)
+                    values["password"] = hash_password(password)
+                db.session.execute(update(User).where(User.id == existing_user.id).values(**values))
                 db.session.commit()
                 print(f"✅ User '{existing_user.username}' updated with admin privileges.")
                 return True
@@ -63,7 +105,7 @@ def create_admin_user(username, email, password, update_if_exists=False):
             new_user = User(
                 username=username,
                 email=email,
-                password=generate_password_hash(password),
+                password=hash_password(password),
                 is_verified=True,  # Auto-verify admin users
                 is_admin=True,
             )
@@ -73,25 +115,97 @@ def create_admin_user(username, email, password, update_if_exists=False):
             return True
 
 
+# ---------------------------
+# Batch admin creation (seeding)
+# ---------------------------
+def create_admin_users(users):
+    """Create several admins from dicts with username, email and password in one INSERT.
+
+    All-or-nothing: a weak password, a duplicate within the batch or an existing
+    username/email rejects the whole batch before anything is hashed or written.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from sqlalchemy import insert, or_, select
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from app.models import User
+
+    users = list(users)
+    for user in users:
+        valid, msg = validate_password_strength(user["password"])
+        if not valid:
+            print(f"❌ Error for '{user['username']}': {msg}")
+            return False
+
+    usernames = [u["username"] for u in users]
+    emails = [u["email"] for u in users]
+    if len(set(usernames)) != len(usernames) or len(set(emails)) != len(emails):
+        print("❌ Error: Duplicate username or email within the batch.")
+        return False
+
+    app = _get_app()
+    with app.app_context():
+        taken = db.session.execute(
+            select(User.username)
+            .where(or_(User.username.in_(usernames), User.email.in_(emails)))
+        ).scalars().all()
+        if taken:
+            print(f"⚠️ Users already exist: {', '.join(taken)}. Use create_admin_user with update_if_exists to promote them.")
+            return False
+
+        # Hashing dominates and is CPU-bound, so spread it across cores for real batches
+        hasher = partial(generate_password_hash, method=app.config.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1"))
+        passwords = [u["password"] for u in users]
+        if len(passwords) > 1:
+            with ProcessPoolExecutor(max_workers=min(len(passwords), os.cpu_count() or 1)) as pool:
+                hashes = list(pool.map(hasher, passwords))
+        else:
+            hashes = [hasher(p) for p in passwords]
+
+        db.session.execute(insert(User), [
+            {
+                "username": u["username"],
+                "email": u["email"],
+                "password": pw_hash,
+                "is_verified": True,  # Auto-verify admin users
+                "is_admin": True,
+            }
+            for u, pw_hash in zip(users, hashes)
+        ])
+        db.session.commit()
+        print(f"✅ Created {len(users)} admin users.")
+        return True
+
+
 # ---------------------------
 # CLI Entrypoint
 # ---------------------------
+def _read_line():
+    """Next line of piped stdin, without the newline; no terminal setup involved."""
+    return sys.stdin.readline().rstrip("\n")
+
+
 def main():
     import argparse
 
     parser = argparse.ArgumentParser(description="Create an admin user for the application.")
     parser.add_argument("--username", "-u", help="Admin username")
     parser.add_argument("--email", "-e", help="Admin email")
-    parser.add_argument("--password", "-p", help="Admin password (not recommended, use interactive prompt instead)")
+    parser.add_argument("--password", "-p", help="Admin password (not recommended, use interactive prompt instead; '-' reads it from stdin)")
     parser.add_argument("--update", action="store_true", help="Update existing user with admin privileges")
 
     args = parser.parse_args()
 
-    username = args.username or input("Enter admin username: ").strip()
-    email = args.email or input("Enter admin email: ").strip()
+    # Piped stdin (CI provisioning) supplies missing fields one per line: username, email, password
+    interactive = sys.stdin.isatty()
+    prompt = input if interactive else lambda _label: _read_line()
+    username = args.username or prompt("Enter admin username: ").strip()
+    email = args.email or prompt("Enter admin email: ").strip()
     password = args.password
 
-    if not password:
+    if password == "-" or (not password and not interactive):
+        password = _read_line()
+    elif not password:
         password = getpass("Enter admin password: ")
         confirm = getpass("Confirm admin password: ")
         if password != confirm:
@@ -108,5 +222,13 @@ def main():
 
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    # Load environment variables from .env file if present, unless a parent process already did;
+    # importing this module as a library leaves the environment alone
+    if os.environ.get("_DOTENV_LOADED") != "1":
+        load_dotenv()
+        os.environ["_DOTENV_LOADED"] = "1"
+
     success = main()
     sys.exit(0 if success else 1)
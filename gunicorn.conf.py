@@ -0,0 +1,11 @@
+# gunicorn.conf.py -- loaded automatically when gunicorn is started from this directory
+import sys
+
+
+def post_fork(server, worker):
+    # With --preload the app was built in the master, whose health-monitor thread doesn't
+    # survive the fork; without it main isn't imported yet and the worker starts its own
+    main = sys.modules.get("main")
+    monitor = getattr(getattr(main, "app", None), "health_monitor", None)
+    if monitor is not None:
+        monitor.restart_after_fork()
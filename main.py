@@ -1,96 +1,290 @@
 import os
+import json
 import logging
-import requests
+import urllib3
 from urllib.parse import urlparse
 from functools import wraps
+import threading
 import time
 from dotenv import load_dotenv
 from app import create_app, db
 from flask_migrate import Migrate
-from urllib.parse import urlparse
 
 
-# Load environment variables from .env file if present
-load_dotenv()
+# Load environment variables from .env file if present; child processes inherit the
+# result through os.environ, so the file is parsed once per process tree
+if os.environ.get("_DOTENV_LOADED") != "1":
+    load_dotenv()
+    os.environ["_DOTENV_LOADED"] = "1"
 
-# Configure logging
+# Configure logging; the app package always logs through stdlib logging.
+# LOG_BACKEND=picologging moves only this module's logger onto the C-accelerated drop-in.
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+if os.getenv("LOG_BACKEND", "logging").lower() == "picologging":
+    try:
+        import picologging
+    except ImportError:
+        logger.warning("LOG_BACKEND=picologging but picologging is not installed; using stdlib logging")
+    else:
+        picologging.basicConfig(level=picologging.INFO)
+        logger = picologging.getLogger(__name__)
 
+# Only real level names; getattr(logging, ...) would also resolve e.g. LOG_LEVEL=BASIC_FORMAT
+_LEVELS = {name: getattr(logging, name) for name in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")}
 log_level = os.getenv("LOG_LEVEL", "INFO").upper()
-logger.setLevel(getattr(logging, log_level, logging.INFO))
+logger.setLevel(_LEVELS.get(log_level, logging.INFO))
+
+# Level checks resolved once at import, since LOG_LEVEL is only read here
+_INFO_ENABLED = logger.isEnabledFor(logging.INFO)
+_DEBUG = logger.isEnabledFor(logging.DEBUG)
+
+
+def _build_pool():
+    """urllib3 pool for backend probes, so repeat checks reuse the keep-alive socket.
+
+    A bare HEAD needs none of requests' session machinery, so this skips that layer.
+    """
+    return urllib3.PoolManager(
+        num_pools=4,
+        maxsize=16,
+        # raise_on_status=False hands back the last response so its status is still reported
+        retries=urllib3.Retry(total=2, backoff_factor=0.1, status_forcelist=(502, 503, 504),
+                              redirect=False, raise_on_status=False),
+    )
+
+
+_pool = _build_pool()
+
+HEALTH_TIMEOUT = urllib3.Timeout(connect=2, read=3)
+
+# Last successful probe, shared by restarts and sibling workers so they can skip their own
+HEALTH_CACHE_PATH = os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "colab_health.json"
+)
 
 
 def monitor_response_time(func):
+    # Bound once per decorated function instead of looked up on every call
+    name = func.__name__
+    perf_counter = time.perf_counter
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
+        start = perf_counter()
         try:
             result = func(*args, **kwargs)
-            end_time = time.time()
-            duration = end_time - start_time
-            logger.info(f"Operation '{func.__name__}' completed in {duration:.2f} seconds")
-            return result
         except Exception as e:
-            end_time = time.time()
-            duration = end_time - start_time
-            logger.error(f"Operation '{func.__name__}' failed after {duration:.2f} seconds: {str(e)}")
+            logger.error("Operation '%s' failed after %.2f seconds: %s", name, perf_counter() - start, e)
             raise
+        if _INFO_ENABLED:
+            logger.info("Operation '%s' completed in %.2f seconds", name, perf_counter() - start)
+        return result
     return wrapper
 
-def validate_backend_url(url):
+def validate_backend_url(url, pool=None):
+    """Probe `url`/health and return (is_valid, message)."""
+    pool = pool or _pool
     try:
         parsed_url = urlparse(url)
         if not all([parsed_url.scheme, parsed_url.netloc]):
             return False, "Invalid URL format"
 
         health_url = f"{url.rstrip('/')}/health"
-        response = requests.get(health_url, timeout=5)
+        # Headers are all the probe needs; (connect, read) bounds a hung handshake separately
+        start = time.perf_counter() if _DEBUG else 0.0
+        response = pool.request("HEAD", health_url, timeout=HEALTH_TIMEOUT, redirect=False)
+        if response.status == 405:
+            response = pool.request("GET", health_url, timeout=HEALTH_TIMEOUT, redirect=False)
+        if _DEBUG:
+            logger.debug("Probed %s -> %s in %.3fs", health_url, response.status, time.perf_counter() - start)
 
-        if response.status_code == 200:
-            logger.info("✅ Colab backend /health check passed")
+        # A redirecting load balancer in front of the backend still counts as reachable
+        if 200 <= response.status < 400:
+            if _INFO_ENABLED:
+                logger.info("✅ Colab backend /health check passed")
             return True, "Backend is accessible"
         else:
-            logger.error(f"Backend /health check failed with status code: {response.status_code}")
-            return False, f"Backend not accessible (Status: {response.status_code})"
-    except requests.Timeout:
-        logger.error("Backend connection timed out")
-        return False, "Backend connection timeout"
+            logger.error("Backend /health check failed with status code: %s", response.status)
+            return False, f"Backend not accessible (Status: {response.status})"
     except Exception as e:
-        logger.error(f"Backend connection error: {str(e)}")
+        # Exhausted retries wrap the underlying error in MaxRetryError; a refused connection
+        # (NewConnectionError) subclasses ConnectTimeoutError in urllib3 but isn't a timeout
+        cause = e.reason if isinstance(e, urllib3.exceptions.MaxRetryError) else e
+        if (isinstance(cause, urllib3.exceptions.TimeoutError)
+                and not isinstance(cause, urllib3.exceptions.NewConnectionError)):
+            logger.error("Backend connection timed out")
+            return False, "Backend connection timeout"
+        logger.error("Backend connection error: %s", e)
         return False, f"Error: {str(e)}"
 
-# Initialize Flask app
-app = create_app()
 
-# Get backend URL from environment, no default fallback to force explicit setting
-colab_url = os.getenv('COLAB_ENDPOINT', '').strip()
+class BackendHealthMonitor:
+    """Re-probes the backend every `ttl` seconds on a daemon thread and publishes the
+    result to app.config, so request handlers read a flag instead of probing."""
+
+    def __init__(self, app, url, pool, ttl=30):
+        self.app = app
+        self.url = url
+        self.pool = pool
+        self.ttl = ttl
+        self.parsed_url = urlparse(url)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._available = None
+        # OFFLINE_MODE set in the environment stays on whatever the probes say
+        self._offline_default = app.config.get('OFFLINE_MODE', False)
+        self._thread = None
 
-# Fail fast if no backend URL is set
-if not colab_url:
-    raise RuntimeError("COLAB_ENDPOINT environment variable must be set to your backend URL!")
+    def start(self, delay=0.0):
+        """Run the loop in the background, first probing after `delay` seconds."""
+        self._thread = threading.Thread(
+            target=self._run, args=(delay,), name="backend-health", daemon=True
+        )
+        self._thread.start()
+        return self
 
-# Set backend URL and timeout in app config
-app.config['COLAB_ENDPOINT'] = colab_url
-app.config['BACKEND_TIMEOUT'] = int(os.getenv('BACKEND_TIMEOUT', 60))
+    def restore_cached(self):
+        """Publish a success another process saved for this URL within the last ttl.
 
-# Validate backend availability before starting
-is_valid, message = validate_backend_url(colab_url)
-app.config['BACKEND_AVAILABLE'] = is_valid
+        Returns the seconds until that result goes stale (when the first real probe is
+        due), or None when there is nothing fresh to reuse.
+        """
+        try:
+            with open(HEALTH_CACHE_PATH) as f:
+                cached = json.load(f)
+            age = time.time() - cached["ts"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if cached.get("url") != self.url or not cached.get("ok") or not 0 <= age < self.ttl:
+            return None
+        if _INFO_ENABLED:
+            logger.info("Reusing backend health check from %.0fs ago", age)
+        self._publish(True, "Backend is accessible", checked_at=cached["ts"])
+        return self.ttl - age
+
+    def _save_cache(self, is_valid, checked_at):
+        # Only successes are worth sharing; a failure drops the entry so nobody skips a probe
+        try:
+            if is_valid:
+                os.makedirs(os.path.dirname(HEALTH_CACHE_PATH), exist_ok=True)
+                tmp_path = f"{HEALTH_CACHE_PATH}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"url": self.url, "ok": True, "ts": checked_at}, f)
+                os.replace(tmp_path, HEALTH_CACHE_PATH)
+            else:
+                os.remove(HEALTH_CACHE_PATH)
+        except OSError:
+            pass
 
-if is_valid:
-    parsed = urlparse(colab_url)
-    safe_host = f"{parsed.scheme}://{parsed.netloc}"
-    logger.info(f"✅ Connected to Colab backend at {safe_host}")
+    def restart_after_fork(self):
+        """Resume probing in a forked gunicorn worker (called from post_fork in gunicorn.conf.py).
 
-else:
-    logger.error(f"⚠️ Could not connect to Colab backend: {message}")
+        Threads don't survive fork, so the worker keeps the master's last result, gets its
+        own lock and sockets, and probes again once that result is due for a refresh.
+        """
+        self._lock = threading.Lock()
+        self.pool = _build_pool()
+        self.start(delay=self.ttl)
+
+    def _run(self, delay):
+        if delay:
+            time.sleep(delay)
+        while True:
+            self.check()
+            time.sleep(self.ttl)
+
+    def check(self):
+        """Probe once, publish the result and return (is_valid, message)."""
+        with self._lock:
+            is_valid, message = validate_backend_url(self.url, self.pool)
+            if is_valid:
+                self._failures = 0
+            else:
+                self._failures += 1
+                if self._failures == 2:
+                    # Two misses in a row may be a pool of dead sockets to a recycled tunnel
+                    if _INFO_ENABLED:
+                        logger.info("Rebuilding backend connection pool after consecutive failed probes")
+                    self.pool.clear()
+                    self.pool = _build_pool()
+            checked_at = time.time()
+            self._publish(is_valid, message, checked_at)
+            self._save_cache(is_valid, checked_at)
+        return is_valid, message
+
+    def _publish(self, is_valid, message, checked_at):
+        config = self.app.config
+        config['BACKEND_AVAILABLE'] = is_valid
+        config['BACKEND_LAST_CHECKED'] = checked_at
+        if is_valid:
+            config.pop('BACKEND_ERROR_MESSAGE', None)
+            config['OFFLINE_MODE'] = self._offline_default
+        else:
+            config['BACKEND_ERROR_MESSAGE'] = f"Backend connection failed: {message}"
+            config['OFFLINE_MODE'] = True
+
+        # Log transitions only; the probe itself logs every check
+        if is_valid == self._available:
+            return
+        self._available = is_valid
+        if is_valid:
+            if _INFO_ENABLED:
+                logger.info("✅ Connected to Colab backend at %s://%s",
+                            self.parsed_url.scheme, self.parsed_url.netloc)
+        else:
+            logger.error("⚠️ Could not connect to Colab backend: %s", message)
+            if _INFO_ENABLED:
+                logger.info("Image generation features may be unavailable until the backend recovers")
+
+def build_app():
+    """Create the Flask app, wire in the backend settings and start health monitoring."""
+    app = create_app()
+
+    # Get backend URL from environment, no default fallback to force explicit setting
+    colab_url = os.getenv('COLAB_ENDPOINT', '').strip()
+
+    # Fail fast if no backend URL is set
+    if not colab_url:
+        raise RuntimeError("COLAB_ENDPOINT environment variable must be set to your backend URL!")
+
+    # Set backend URL and timeout in app config
+    app.config['COLAB_ENDPOINT'] = colab_url
+    app.config['BACKEND_TIMEOUT'] = int(os.getenv('BACKEND_TIMEOUT', 60))
+
+    # Probe the backend in the background and keep re-checking it; startup doesn't wait on
+    # the network unless STRICT_BACKEND_CHECK requires a healthy backend before serving
+    app.config['BACKEND_AVAILABLE'] = False
+    health_monitor = BackendHealthMonitor(
+        app, colab_url, _pool, ttl=float(os.getenv('BACKEND_HEALTH_TTL', 30))
+    )
     if os.getenv("STRICT_BACKEND_CHECK", "false").lower() == "true":
-        raise RuntimeError(f"Backend not accessible: {message}")
-    logger.info("Application will start but image generation features may be unavailable")
-    app.config['BACKEND_ERROR_MESSAGE'] = f"Backend connection failed: {message}"
-    app.config['OFFLINE_MODE'] = True
+        first_probe_in = health_monitor.restore_cached()
+        if first_probe_in is None:
+            is_valid, message = health_monitor.check()
+            if not is_valid:
+                raise RuntimeError(f"Backend not accessible: {message}")
+            first_probe_in = health_monitor.ttl
+        health_monitor.start(first_probe_in)
+    else:
+        # A fresh result saved by a sibling worker or the previous run defers the first probe
+        health_monitor.start(health_monitor.restore_cached() or 0.0)
+    app.health_monitor = health_monitor
+    return app
+
+
+# Spawned workers (the local BERT pool) re-import this module as __mp_main__; they only
+# need its definitions, not a second app with its own schema check, Redis client and probes
+if __name__ != '__mp_main__':
+    app = build_app()
 
 if __name__ == '__main__':
-    # Run Flask app on all network interfaces, debug off for production
-    app.run(host='0.0.0.0', port=5000, use_reloader=False, debug=app.config.get('DEBUG', False))
+    # Serve on all network interfaces with waitress; for multiple processes use
+    # `gunicorn -w $(nproc) --preload main:app` so startup runs once before the fork
+    try:
+        from waitress import serve
+    except ImportError:
+        logger.warning("waitress is not installed; falling back to the Flask development server")
+        app.run(host='0.0.0.0', port=5000, use_reloader=False, debug=app.config.get('DEBUG', False))
+    else:
+        serve(app, host='0.0.0.0', port=5000, threads=int(os.getenv("WAITRESS_THREADS", 8)))
@@ -0,0 +1,142 @@
+# tests/test_routes_queries.py
+"""Query helpers in app/routes.py: favorites keyset paging, the user-style upsert and the
+ownership-checked message insert. Runs against a throwaway SQLite database:
+
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+_TMP_DIR = tempfile.mkdtemp()
+os.environ.update(
+    SECRET_KEY="test-secret-key-0123456789abcdef",
+    DATABASE_PATH=os.path.join(_TMP_DIR, "test.db"),
+    RUN_CREATE_ALL="0",
+)
+os.environ.pop("REDIS_URL", None)
+os.environ.pop("COLAB_ENDPOINT", None)
+
+from app import create_app, db  # noqa: E402
+from app.models import User, UserStyle, ChatSession, ChatMessage, FavoriteImage  # noqa: E402
+from app.routes import increment_user_style, insert_owned_message  # noqa: E402
+
+
+def tearDownModule():
+    shutil.rmtree(_TMP_DIR, ignore_errors=True)
+
+
+class RouteQueryTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app()
+        cls.app.config.update(SESSION_COOKIE_SECURE=False, RATELIMIT_ENABLED=False)
+
+    def setUp(self):
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        self.alice = self._add_user("alice")
+        self.bob = self._add_user("bob")
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def _add_user(self, name):
+        user = User(username=name, email=f"{name}@example.com", password="x", is_verified=True)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+    def _client_for(self, user_id):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+            session["_fresh"] = True
+        return client
+
+
+class FavoritesPaginationTest(RouteQueryTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            db.session.add(FavoriteImage(user_id=self.alice, image_url=f"/img/a{i}.png", prompt=f"room {i}"))
+        db.session.add(FavoriteImage(user_id=self.bob, image_url="/img/b.png", prompt="bob's room"))
+        db.session.commit()
+
+    def test_cursor_walks_every_favorite_once_and_ends_on_last_page(self):
+        client = self._client_for(self.alice)
+        pages, before = [], None
+        while True:
+            query = "?page_size=2" + (f"&before={before}" if before else "")
+            body = client.get(f"/api/favorites{query}").get_json()
+            pages.append([f["image_url"] for f in body["favorites"]])
+            before = body["next_cursor"]
+            if before is None:
+                break
+        self.assertEqual(
+            pages, [["/img/a4.png", "/img/a3.png"], ["/img/a2.png", "/img/a1.png"], ["/img/a0.png"]]
+        )
+
+    def test_exactly_full_last_page_has_no_cursor(self):
+        body = self._client_for(self.alice).get("/api/favorites?page_size=5").get_json()
+        self.assertEqual(len(body["favorites"]), 5)
+        self.assertIsNone(body["next_cursor"])
+
+    def test_other_users_favorites_are_not_listed(self):
+        body = self._client_for(self.bob).get("/api/favorites").get_json()
+        self.assertEqual([f["image_url"] for f in body["favorites"]], ["/img/b.png"])
+
+
+class IncrementUserStyleTest(RouteQueryTestCase):
+    def _counts(self):
+        rows = db.session.execute(
+            db.select(UserStyle.user_id, UserStyle.style_name, UserStyle.count).order_by(UserStyle.id)
+        ).all()
+        return [tuple(r) for r in rows]
+
+    def test_first_use_inserts_a_row(self):
+        increment_user_style(self.alice, "modern")
+        db.session.commit()
+        self.assertEqual(self._counts(), [(self.alice, "modern", 1)])
+
+    def test_existing_row_is_incremented_in_place(self):
+        increment_user_style(self.alice, "modern")
+        increment_user_style(self.alice, "modern")
+        increment_user_style(self.alice, "rustic")
+        increment_user_style(self.bob, "modern")
+        db.session.commit()
+        self.assertEqual(
+            self._counts(),
+            [(self.alice, "modern", 2), (self.alice, "rustic", 1), (self.bob, "modern", 1)],
+        )
+
+
+class InsertOwnedMessageTest(RouteQueryTestCase):
+    def setUp(self):
+        super().setUp()
+        chat = ChatSession(user_id=self.alice, name="alice's chat")
+        db.session.add(chat)
+        db.session.commit()
+        self.session_uuid = chat.uuid
+
+    def test_owner_gets_the_new_message_id(self):
+        message_id = insert_owned_message(self.session_uuid, self.alice, "hello", True)
+        db.session.commit()
+        message = db.session.get(ChatMessage, message_id)
+        self.assertEqual((message.session_id, message.user_id, message.content), (self.session_uuid, self.alice, "hello"))
+
+    def test_foreign_session_returns_none_and_inserts_nothing(self):
+        self.assertIsNone(insert_owned_message(self.session_uuid, self.bob, "intrusion", True))
+        db.session.commit()
+        self.assertEqual(db.session.query(ChatMessage).count(), 0)
+
+    def test_unknown_session_returns_none(self):
+        self.assertIsNone(insert_owned_message("no-such-session", self.alice, "hello", True))
+
+
+if __name__ == "__main__":
+    unittest.main()